@@ -0,0 +1,518 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the Submit and Compare XBlock views and handlers
+
+Runs every view and JSON handler across a range of question sizes,
+hint counts and answer sizes, and reports ops/sec, p50/p99 latency and
+peak memory, measured in a separate untimed pass, as JSON, e.g.:
+
+    python benchmark.py --iterations 200 --output bench_output.json
+
+With --import-time, also measures how long importing the package takes in
+a fresh interpreter, failing if it exceeds --max-import-ms.
+"""
+import argparse
+import gc
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import textwrap
+import time
+
+import mock
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'submit_and_compare.settings')
+
+import django  # pylint: disable=wrong-import-position
+django.setup()
+
+# pylint: disable=wrong-import-position
+from opaque_keys.edx.locations import SlashSeparatedCourseKey
+from webob import Request, Response
+from xblock.field_data import DictFieldData
+
+from submit_and_compare.caching import clear_render_caches
+from submit_and_compare.submit_and_compare import (
+    SubmitAndCompareXBlock,
+    clear_parsed_questions,
+    clear_resource_cache,
+)
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Approximate size of the question body, in bytes
+QUESTION_SIZES = {
+    'tiny': 0,
+    'small': 2 * 1024,
+    'medium': 32 * 1024,
+    'large': 256 * 1024,
+}
+HINT_COUNTS = (0, 2, 10, 50)
+ANSWER_SIZES = (0, 100, 10 * 1024, 100 * 1024)
+
+# Memory is measured over this many calls, after the timed ones
+MEMORY_ITERATIONS = 10
+
+LEARNER_STATE_FIELDS = (
+    'student_answer',
+    'count_attempts',
+    'score',
+    'draft_answer',
+    'learner_state',
+)
+
+PARAGRAPH = (
+    '<p>Before you begin the simulation, think for a minute about your '
+    'hypothesis. What do you expect the outcome of the simulation will be? '
+    '<img src="/static/simulation.png" alt="Simulation"/></p>\n'
+)
+
+
+def make_question(size, hint_count):
+    """
+    Builds question XML whose body is roughly `size` bytes long
+    """
+    paragraphs = PARAGRAPH * max(1, size // len(PARAGRAPH))
+    hints = ''.join(
+        '<hint>Hint number {} about the hypothesis.</hint>'.format(i)
+        for i in range(hint_count)
+    )
+    return textwrap.dedent(u"""
+        <submit_and_compare schema_version='1'>
+            <body>{paragraphs}</body>
+            <explanation>{paragraphs}</explanation>
+            <demandhint>{hints}</demandhint>
+        </submit_and_compare>
+    """).format(paragraphs=paragraphs, hints=hints)
+
+
+def make_block(**field_values):
+    """
+    Creates a block backed by DictFieldData and a mock runtime,
+    as the unit tests do
+    """
+    course_id = SlashSeparatedCourseKey('foo', 'bar', 'baz')
+    settings_service = mock.Mock()
+    # Rate limiting would turn repeated publish_event calls into rejections,
+    # and the length limit would reject the largest answers
+    settings_service.get_settings_bucket.return_value = {
+        'event_rate_limit': 0,
+        'max_answer_length': 0,
+    }
+    runtime = mock.Mock(course_id=course_id)
+    runtime.service.return_value = settings_service
+    scope_ids = mock.Mock()
+    block = SubmitAndCompareXBlock(
+        runtime,
+        DictFieldData(field_values),
+        scope_ids,
+    )
+    block.xmodule_runtime = runtime
+    return block
+
+
+def json_request(data):
+    """
+    Builds a POST request carrying JSON data
+    """
+    return Request.blank(
+        '/',
+        method='POST',
+        body=json.dumps(data).encode('utf8'),
+    )
+
+
+def studio_data(block):
+    """
+    Returns the data posted by the studio view for a block
+    """
+    return {
+        'display_name': block.display_name,
+        'weight': '1',
+        'max_attempts': '0',
+        'your_answer_label': block.your_answer_label,
+        'our_answer_label': block.our_answer_label,
+        'submit_button_label': block.submit_button_label,
+        'data': block.question_string,
+    }
+
+
+def check_succeeded(response):
+    """
+    Raises RuntimeError if a handler's response reports a failure, so that
+    a scenario never times a rejection instead of the work it names
+    """
+    if not isinstance(response, Response):
+        return
+    result = json.loads(response.body.decode('utf8'))
+    if result.get('success') is False or result.get('result') == 'error':
+        raise RuntimeError('The operation failed: {}'.format(result))
+
+
+def clear_learner_state(block):
+    """
+    Removes the learner's answer, attempts and score from a block
+    """
+    for name in LEARNER_STATE_FIELDS:
+        if block.fields[name].is_set_on(block):
+            delattr(block, name)
+
+
+def scenarios():
+    """
+    Yields (name, parameters, setup) for every benchmark, where setup
+    returns the operation to time and a function to call, untimed, before
+    each call of the operation (or None)
+    """
+    def view(view_name, question_string):
+        def setup():
+            block = make_block(question_string=question_string)
+            return getattr(block, view_name), None
+        return setup
+
+    def handler(handler_name, data_factory, first_call=False, **field_values):
+        def setup():
+            block = make_block(**field_values)
+            data = data_factory(block)
+            method = getattr(block, handler_name)
+            prepare = None
+            if first_call:
+                # Otherwise every call after the first would be an
+                # unchanged resubmission
+                prepare = lambda: clear_learner_state(block)
+            return lambda: method(json_request(data)), prepare
+        return setup
+
+    for size_name, size in sorted(QUESTION_SIZES.items(), key=lambda x: x[1]):
+        for hint_count in HINT_COUNTS:
+            question_string = make_question(size, hint_count)
+            parameters = {
+                'question_size': size_name,
+                'question_bytes': len(question_string.encode('utf8')),
+                'hints': hint_count,
+            }
+            for view_name in ('student_view', 'studio_view'):
+                yield (
+                    view_name,
+                    parameters,
+                    view(view_name, question_string),
+                )
+            yield (
+                'send_hints',
+                parameters,
+                handler(
+                    'send_hints',
+                    lambda block: {'requested': True},
+                    question_string=question_string,
+                ),
+            )
+        yield (
+            'studio_submit',
+            {
+                'question_size': size_name,
+                'question_bytes': len(question_string.encode('utf8')),
+            },
+            handler(
+                'studio_submit',
+                studio_data,
+                question_string=question_string,
+            ),
+        )
+    for answer_size in ANSWER_SIZES:
+        answer = 'x' * answer_size
+        yield (
+            'student_submit',
+            {'answer_bytes': answer_size},
+            handler(
+                'student_submit',
+                lambda block, answer=answer: {
+                    'answer': answer,
+                    'action': 'submit',
+                },
+                first_call=True,
+            ),
+        )
+    yield (
+        'publish_event',
+        {},
+        handler(
+            'publish_event',
+            lambda block: {'event_type': 'hint_button', 'next_hint_index': 0},
+        ),
+    )
+
+
+# Modules imported by any XBlock, whose cost is not counted against ours
+IMPORT_BASELINE = (
+    'xblock.core',
+    'xblock.fields',
+    'xblock.fragment',
+    'xblockutils.settings',
+)
+
+IMPORT_TIMER = textwrap.dedent("""
+    import json, sys, time
+    {baseline}
+    before = set(sys.modules)
+    start = time.time()
+    import submit_and_compare
+    elapsed = time.time() - start
+    print(json.dumps({{
+        'seconds': elapsed,
+        'modules': sorted(
+            name for name in set(sys.modules) - before
+            if sys.modules[name] is not None
+        ),
+    }}))
+""").format(
+    baseline='\n'.join('import ' + module for module in IMPORT_BASELINE),
+)
+
+
+def time_import():
+    """
+    Imports the package in a fresh interpreter, returning how long the
+    import took, the modules it loaded and, where the interpreter supports
+    -X importtime, the self time of each of them in microseconds
+    """
+    command = [sys.executable]
+    importtime = sys.version_info >= (3, 7)
+    if importtime:
+        command += ['-X', 'importtime']
+    process = subprocess.Popen(
+        command + ['-c', IMPORT_TIMER],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    stdout, stderr = process.communicate()
+    if process.returncode:
+        raise RuntimeError('Unable to import the package:\n' + stderr)
+    result = json.loads(stdout)
+    self_times = {}
+    if importtime:
+        for line in stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            fields = line.split('|')
+            if len(fields) != 3 or not line.startswith('import time:'):
+                continue
+            try:
+                self_time = int(fields[0].split(':')[1])
+            except ValueError:
+                continue
+            self_times[fields[2].strip()] = self_time
+    result['self_us'] = {
+        module: self_times[module]
+        for module in result['modules'] if module in self_times
+    }
+    return result
+
+
+def measure_import_time(repeat):
+    """
+    Times `repeat` imports of the package, returning their statistics
+    """
+    runs = [time_import() for _ in range(repeat)]
+    durations = sorted(run['seconds'] for run in runs)
+    slowest = sorted(
+        runs[-1]['self_us'].items(),
+        key=lambda item: item[1],
+        reverse=True,
+    )[:10]
+    return {
+        'repeat': repeat,
+        'median_ms': percentile(durations, 0.50) * 1000,
+        'min_ms': durations[0] * 1000,
+        'modules': len(runs[-1]['modules']),
+        'slowest_modules_us': slowest,
+    }
+
+
+def clear_caches():
+    """
+    Empties every process-wide cache
+    """
+    clear_parsed_questions()
+    clear_resource_cache()
+    clear_render_caches()
+
+
+def percentile(sorted_values, fraction):
+    """
+    Returns the value below which `fraction` of the sorted values fall
+    """
+    index = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def run_scenario(index, setup, iterations, cold):
+    """
+    Times an operation, then measures its memory use in a separate pass,
+    returning their statistics
+    """
+    operation, prepare = setup()
+    check_succeeded(operation())  # warm up
+    gc.collect()
+    latencies = []
+    elapsed = 0
+    for _ in range(iterations):
+        if cold:
+            clear_caches()
+        if prepare is not None:
+            prepare()
+        start = time.time()
+        operation()
+        latencies.append(time.time() - start)
+        elapsed += latencies[-1]
+    latencies.sort()
+    result = {
+        'iterations': iterations,
+        'ops_per_sec': iterations / elapsed if elapsed else None,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+    if tracemalloc is not None:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            repeat_operation(operation, prepare, cold)
+            result['peak_traced_bytes'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    else:
+        result['peak_rss_growth_kb'] = measure_rss_growth(index, cold)
+    return result
+
+
+def repeat_operation(operation, prepare, cold):
+    """
+    Calls an operation MEMORY_ITERATIONS times
+    """
+    for _ in range(MEMORY_ITERATIONS):
+        if cold:
+            clear_caches()
+        if prepare is not None:
+            prepare()
+        operation()
+
+
+def measure_rss_growth(index, cold):
+    """
+    Returns how much the peak resident set size of a fresh interpreter
+    grows over MEMORY_ITERATIONS calls of the operation of the scenario
+    at `index`, in kilobytes
+
+    Without tracemalloc (Python 2), the peak RSS is the only measure of
+    memory use, and it is shared by every scenario run in one process.
+    """
+    command = [
+        sys.executable,
+        os.path.abspath(__file__),
+        '--rss-growth-of', str(index),
+    ]
+    if cold:
+        command.append('--cold')
+    return json.loads(subprocess.check_output(command).decode('ascii'))
+
+
+def rss_growth(index, cold):
+    """
+    Returns how much the peak RSS of this process grows over
+    MEMORY_ITERATIONS calls of the operation of the scenario at `index`
+    """
+    _, _, setup = next(itertools.islice(scenarios(), index, None))
+    operation, prepare = setup()
+    gc.collect()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    repeat_operation(operation, prepare, cold)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+
+
+def main(argv=None):
+    """
+    Runs the benchmarks and writes their results as JSON
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument(
+        '--iterations', type=int, default=50,
+        help='number of timed calls per scenario',
+    )
+    parser.add_argument(
+        '--only', action='append', default=[],
+        help='only run the named view or handler (repeatable)',
+    )
+    parser.add_argument(
+        '--cold', action='store_true',
+        help='empty the process-wide caches before every call',
+    )
+    parser.add_argument(
+        '--import-time', action='store_true',
+        help='also measure the time taken to import the package',
+    )
+    parser.add_argument(
+        '--import-repeat', type=int, default=10,
+        help='number of fresh interpreters to time the import in',
+    )
+    parser.add_argument(
+        '--max-import-ms', type=float, default=None,
+        help='exit with an error if the median import time exceeds this',
+    )
+    parser.add_argument(
+        '--output', type=argparse.FileType('w'), default=sys.stdout,
+        help='file to write the JSON results to (default: stdout)',
+    )
+    # Used by measure_rss_growth to measure one scenario in a new process
+    parser.add_argument(
+        '--rss-growth-of', type=int, default=None,
+        help=argparse.SUPPRESS,
+    )
+    args = parser.parse_args(argv)
+    if args.rss_growth_of is not None:
+        json.dump(rss_growth(args.rss_growth_of, args.cold), sys.stdout)
+        return 0
+
+    report = {
+        'python': sys.version.split()[0],
+    }
+    if args.import_time or args.max_import_ms is not None:
+        report['import'] = measure_import_time(args.import_repeat)
+
+    results = []
+    for index, (name, parameters, setup) in enumerate(scenarios()):
+        if args.only and name not in args.only:
+            continue
+        clear_caches()
+        result = {
+            'name': name,
+            'parameters': parameters,
+            'cold': args.cold,
+        }
+        result.update(
+            run_scenario(index, setup, args.iterations, args.cold)
+        )
+        results.append(result)
+    report['results'] = results
+    json.dump(report, args.output, indent=2, sort_keys=True)
+    args.output.write('\n')
+
+    if args.max_import_ms is not None and \
+            report['import']['median_ms'] > args.max_import_ms:
+        sys.stderr.write(
+            'Importing submit_and_compare took {:.1f}ms, '
+            'more than the allowed {:.1f}ms\n'.format(
+                report['import']['median_ms'],
+                args.max_import_ms,
+            )
+        )
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,10 +7,23 @@ fork of edx-platform.
 """
 
 
+import hashlib
+import json
 import os
+import shutil
+from distutils.cmd import Command
 from setuptools import setup
+from setuptools.command.build_py import build_py
 from setuptools.command.test import test as TestCommand
 
+# Static resources that can be served by URL (see the asset_mode setting),
+# relative to the package
+PUBLIC_ASSETS = [
+    'static/css/submit_and_compare.css',
+    'static/js/submit_and_compare_edit.js',
+    'static/js/submit_and_compare_view.js',
+]
+
 def package_data(pkg, root):
     """Generic function to find package_data for `pkg` under `root`."""
     data = []
@@ -21,6 +34,49 @@ def package_data(pkg, root):
     return {pkg: data}
 
 
+class BuildAssets(Command):
+    """
+    Writes a content-hashed copy of each public asset to
+    submit_and_compare/public/, and a manifest.json mapping each asset
+    to its copy, so that browsers can cache them indefinitely
+    """
+    description = 'build content-hashed copies of the static assets'
+    user_options = []
+
+    def initialize_options(self):
+        pass
+
+    def finalize_options(self):
+        pass
+
+    def run(self):
+        public_dir = os.path.join('submit_and_compare', 'public')
+        if os.path.isdir(public_dir):
+            shutil.rmtree(public_dir)
+        os.makedirs(public_dir)
+        manifest = {}
+        for path in PUBLIC_ASSETS:
+            source = os.path.join('submit_and_compare', path)
+            with open(source, 'rb') as asset:
+                digest = hashlib.sha1(asset.read()).hexdigest()[:12]
+            name, extension = os.path.splitext(os.path.basename(path))
+            public_name = '{}.{}{}'.format(name, digest, extension)
+            shutil.copyfile(source, os.path.join(public_dir, public_name))
+            manifest[path] = 'public/' + public_name
+        with open(os.path.join(public_dir, 'manifest.json'), 'w') as output:
+            json.dump(manifest, output, indent=2, sort_keys=True)
+
+
+class BuildPy(build_py):
+    """
+    Builds the public assets before collecting the package files
+    """
+
+    def run(self):
+        self.run_command('build_assets')
+        build_py.run(self)
+
+
 class Tox(TestCommand):
     user_options = [('tox-args=', 'a', "Arguments to pass to tox")]
 
@@ -49,6 +105,8 @@ setup(
     description='Submit and Compare XBlock for self assessment',
     packages=[
         'submit_and_compare',
+        'submit_and_compare.management',
+        'submit_and_compare.management.commands',
     ],
     install_requires=[
         'coverage',
@@ -59,6 +117,11 @@ setup(
         'XBlock',
         'xblock-utils',
     ],
+    extras_require={
+        'similarity': [
+            'numpy',
+        ],
+    },
     dependency_links=[
         'https://github.com/edx/xblock-utils/tarball/c39bf653e4f27fb3798662ef64cde99f57603f79#egg=xblock-utils',
     ],
@@ -70,7 +133,16 @@ setup(
     package_dir={
         'submit_and_compare': 'submit_and_compare',
     },
-    package_data=package_data("submit_and_compare", "static"),
+    package_data={
+        'submit_and_compare': (
+            package_data('submit_and_compare', 'static')['submit_and_compare'] +
+            ['public/*']
+        ),
+    },
+    cmdclass={
+        'build_assets': BuildAssets,
+        'build_py': BuildPy,
+    },
     classifiers=[
         # https://pypi.python.org/pypi?%3Aaction=list_classifiers
         'Intended Audience :: Developers',
@@ -0,0 +1,154 @@
+"""
+Running totals of learner activity on each Submit and Compare XBlock
+
+The totals are counters in a Django cache, updated with atomic increments,
+rather than a block field shared by every learner: concurrent submissions
+neither lose each other's counts nor all rewrite the same row. They are as
+durable as the cache backend, and meant as an overview rather than a
+record; learners' answers themselves can be exported with the
+submit_and_compare_answers command.
+
+Learners by attempts used are counted as the number of learners who made
+at least n attempts, for each n, so that a submission only ever increments
+a single counter.
+"""
+
+from .caching import content_key
+
+ANALYTICS_KEY_PREFIX = 'submit_and_compare.analytics.'
+
+# Answer length buckets are powers of two up to this one
+MAX_LENGTH_BUCKET = 1 << 24
+
+# Number of attempt counters read from the cache at a time
+ATTEMPTS_BATCH_SIZE = 32
+
+
+def get_length_bucket(length):
+    """
+    Returns the lower bound of the power-of-two bucket of a length,
+    i.e. 0, 1, 2, 4, 8, ...
+    """
+    if length == 0:
+        return 0
+    return min(1 << (length.bit_length() - 1), MAX_LENGTH_BUCKET)
+
+
+def _length_buckets():
+    """
+    Returns every answer length bucket, in increasing order
+    """
+    buckets = [0]
+    bucket = 1
+    while bucket <= MAX_LENGTH_BUCKET:
+        buckets.append(bucket)
+        bucket <<= 1
+    return buckets
+
+
+class BlockAnalytics(object):
+    """
+    The activity counters of a block, stored in a Django cache
+    """
+
+    def __init__(self, usage_id, alias='default'):
+        self.key_prefix = '{}{}.'.format(
+            ANALYTICS_KEY_PREFIX,
+            content_key(unicode(usage_id)),
+        )
+        self.alias = alias
+
+    @property
+    def _cache(self):
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    def _increment(self, name):
+        """
+        Atomically adds one to a counter, creating it if needed
+        """
+        key = self.key_prefix + name
+        cache = self._cache
+        if cache.add(key, 1, None):
+            return
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Evicted since add(); the count restarts
+            cache.add(key, 1, None)
+
+    def _get_counts(self, names):
+        """
+        Returns the value of each of a list of counters, 0 if missing
+        """
+        keys = [self.key_prefix + name for name in names]
+        values = self._cache.get_many(keys)
+        return [values.get(key, 0) for key in keys]
+
+    def record_submission(self, answer_length, previous_attempts):
+        """
+        Counts a submitted answer, and the attempt it used
+        """
+        self._increment('submissions')
+        self._increment('attempts.{}'.format(previous_attempts + 1))
+        self._increment(
+            'answer_lengths.{}'.format(get_length_bucket(answer_length))
+        )
+
+    def record_reset(self):
+        """
+        Counts a reset answer
+        """
+        self._increment('resets')
+
+    def record_hint_click(self):
+        """
+        Counts a click on the hint button
+        """
+        self._increment('hint_clicks')
+
+    def _get_attempts(self):
+        """
+        Returns the number of learners by attempts used
+        """
+        at_least = []
+        while not at_least or at_least[-1]:
+            first = len(at_least) + 1
+            at_least.extend(self._get_counts([
+                'attempts.{}'.format(attempts)
+                for attempts in range(first, first + ATTEMPTS_BATCH_SIZE)
+            ]))
+        return {
+            str(attempts): count - at_least[attempts]
+            for attempts, count in enumerate(at_least[:-1], 1)
+            if count > at_least[attempts]
+        }
+
+    def get_totals(self):
+        """
+        Returns every counter, with the share of resets among submissions
+        and resets
+        """
+        submissions, resets, hint_clicks = self._get_counts(
+            ['submissions', 'resets', 'hint_clicks']
+        )
+        if submissions + resets:
+            reset_rate = float(resets) / (submissions + resets)
+        else:
+            reset_rate = 0.0
+        buckets = _length_buckets()
+        lengths = self._get_counts([
+            'answer_lengths.{}'.format(bucket) for bucket in buckets
+        ])
+        return {
+            'submissions': submissions,
+            'resets': resets,
+            'reset_rate': reset_rate,
+            'hint_clicks': hint_clicks,
+            'attempts': self._get_attempts(),
+            'answer_lengths': {
+                str(bucket): count
+                for bucket, count in zip(buckets, lengths)
+                if count
+            },
+        }
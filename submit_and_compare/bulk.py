@@ -0,0 +1,631 @@
+"""
+Bulk export, import and update of learner state for Submit and Compare
+XBlocks
+
+These helpers read and write the LMS courseware StudentModule table
+directly, so they are only usable inside edx-platform.
+"""
+
+import argparse
+import csv
+import json
+import logging
+
+from collections import namedtuple
+
+from .state import LearnerState, pack_learner_state, unpack_learner_state
+
+LOG = logging.getLogger(__name__)
+
+BLOCK_TYPE = 'submit-and-compare'
+
+# The learner state fields that are exported and imported
+STATE_FIELDS = (
+    'student_answer',
+    'count_attempts',
+    'score',
+)
+
+# The compact record replacing STATE_FIELDS, see submit_and_compare.state
+COMPACT_STATE_FIELD = 'learner_state'
+
+EXPORT_COLUMNS = (
+    'course_id',
+    'block_id',
+    'user_id',
+) + STATE_FIELDS
+
+EXPORT_FORMATS = (
+    'csv',
+    'jsonl',
+)
+
+DEFAULT_CHUNK_SIZE = 1000
+
+BULK_ACTIONS = (
+    'reset',
+    'rescore',
+)
+
+# Updated states are written in statements of at most about this many
+# bytes, well below MySQL's default max_allowed_packet
+MAX_UPDATE_BYTES = 1024 * 1024
+
+# A row whose learner state was updated
+_RowChange = namedtuple(
+    '_RowChange',
+    [
+        'id',
+        'user_id',
+        # The serialized state the update was computed from
+        'old_state',
+        # The serialized state to write
+        'state',
+        'learner_state',
+    ],
+)
+
+
+def add_chunk_size_argument(parser):
+    """
+    Adds the --chunk-size option of the management commands to an
+    argparse parser
+    """
+    parser.add_argument(
+        '--chunk-size',
+        type=_positive_int,
+        default=DEFAULT_CHUNK_SIZE,
+        help='number of learner states read or written at a time',
+    )
+
+
+def _positive_int(value):
+    """
+    Converts an option to a positive integer, as an argparse type
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError('must be a positive integer')
+    return number
+
+
+def _get_student_module_model():
+    """
+    Returns the LMS model storing learner state
+    """
+    # pylint: disable=import-error
+    from courseware.models import StudentModule
+    return StudentModule
+
+
+def get_learner_states(course_id=None, block_id=None):
+    """
+    Returns the StudentModule queryset of every Submit and Compare XBlock,
+    optionally restricted to a course and/or a block (as key strings)
+    """
+    from opaque_keys.edx.keys import CourseKey, UsageKey
+    queryset = _get_student_module_model().objects.filter(
+        module_type=BLOCK_TYPE,
+    )
+    if course_id:
+        queryset = queryset.filter(course_id=CourseKey.from_string(course_id))
+    if block_id:
+        queryset = queryset.filter(
+            module_state_key=UsageKey.from_string(block_id),
+        )
+    return queryset
+
+
+def iter_learner_states(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields an export record for every row of a StudentModule queryset
+
+    Rows are read in chunks, see _iter_row_chunks, so memory use stays
+    constant.
+    """
+    chunks = _iter_row_chunks(
+        queryset,
+        ('id', 'course_id', 'module_state_key', 'student_id', 'state'),
+        chunk_size,
+    )
+    for rows in chunks:
+        for row in rows:
+            yield row_to_record(row)
+
+
+def _iter_row_chunks(queryset, fields, chunk_size):
+    """
+    Yields the rows of a StudentModule queryset as lists of dicts
+
+    Rows are read in chunks ordered by primary key, each chunk starting
+    after the last key of the previous one (keyset pagination), so no
+    OFFSET scans are needed.
+    """
+    last_id = 0
+    while True:
+        rows = list(
+            queryset.filter(id__gt=last_id).order_by('id').values(
+                *fields
+            )[:chunk_size]
+        )
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1]['id']
+
+
+def row_to_record(row):
+    """
+    Converts a StudentModule row (as a dict) into an export record
+    """
+    record = state_to_record(row['state'])
+    record.update({
+        'course_id': unicode(row['course_id']),
+        'block_id': unicode(row['module_state_key']),
+        'user_id': row['student_id'],
+    })
+    return record
+
+
+def state_to_record(state):
+    """
+    Extracts the exported fields from a serialized learner state
+    """
+    try:
+        state = json.loads(state or '{}')
+    except ValueError:
+        LOG.warning('Skipping invalid learner state: %r', state)
+        state = {}
+    learner_state = _get_learner_state(state)
+    return {
+        'student_answer': learner_state.answer,
+        'count_attempts': learner_state.attempts,
+        'score': learner_state.score,
+    }
+
+
+def iter_csv_lines(records):
+    """
+    Yields a header, then one CSV line (as UTF-8 bytes) per record
+    """
+    line = _LastWrite()
+    writer = csv.writer(line)
+    writer.writerow(EXPORT_COLUMNS)
+    yield line.value
+    for record in records:
+        writer.writerow([
+            unicode(record[column]).encode('utf8')
+            for column in EXPORT_COLUMNS
+        ])
+        yield line.value
+
+
+def iter_jsonl_lines(records):
+    """
+    Yields one JSON document per line (as UTF-8 bytes) per record
+    """
+    for record in records:
+        yield json.dumps(
+            {column: record[column] for column in EXPORT_COLUMNS},
+            sort_keys=True,
+        ).encode('utf8') + b'\n'
+
+
+def iter_export_lines(records, export_format):
+    """
+    Yields the lines of an export in one of EXPORT_FORMATS
+    """
+    if export_format == 'csv':
+        return iter_csv_lines(records)
+    elif export_format == 'jsonl':
+        return iter_jsonl_lines(records)
+    raise ValueError('Unknown export format: {}'.format(export_format))
+
+
+def iter_import_records(stream, export_format):
+    """
+    Yields the records read from an export in one of EXPORT_FORMATS
+    """
+    if export_format == 'csv':
+        rows = csv.DictReader(stream)
+        for row in rows:
+            yield {
+                'course_id': row['course_id'].decode('utf8'),
+                'block_id': row['block_id'].decode('utf8'),
+                'user_id': int(row['user_id']),
+                'student_answer': row['student_answer'].decode('utf8'),
+                'count_attempts': int(row['count_attempts']),
+                'score': float(row['score']),
+            }
+    elif export_format == 'jsonl':
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        raise ValueError('Unknown export format: {}'.format(export_format))
+
+
+def import_learner_states(records, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Restores exported learner state, in one transaction per chunk of
+    records, and returns the number of records that were imported
+    """
+    imported = 0
+    for chunk in _chunks(records, chunk_size):
+        _import_chunk(chunk)
+        imported += len(chunk)
+    return imported
+
+
+def _import_chunk(records):
+    """
+    Writes the state of a chunk of records, merging it into existing rows
+    with batched UPDATE statements and inserting the others in bulk
+    """
+    from django.db import transaction
+    from opaque_keys.edx.keys import CourseKey, UsageKey
+    student_module = _get_student_module_model()
+    records_by_key = {
+        (record['user_id'], record['block_id']): record
+        for record in records
+    }
+    with transaction.atomic():
+        existing = student_module.objects.select_for_update().filter(
+            module_type=BLOCK_TYPE,
+            student_id__in=set(key[0] for key in records_by_key),
+            module_state_key__in=set(
+                UsageKey.from_string(key[1]) for key in records_by_key
+            ),
+        ).values('id', 'student_id', 'module_state_key', 'state')
+        changes = []
+        for row in existing:
+            record = records_by_key.pop(
+                (row['student_id'], unicode(row['module_state_key'])),
+                None,
+            )
+            if record is None:
+                continue
+            changes.append(_RowChange(
+                id=row['id'],
+                user_id=row['student_id'],
+                old_state=row['state'],
+                state=_merge_state(row['state'], record),
+                learner_state=None,
+            ))
+        for batch in _batches_by_size(changes, MAX_UPDATE_BYTES):
+            _write_states(student_module, batch)
+        student_module.objects.bulk_create([
+            student_module(
+                module_type=BLOCK_TYPE,
+                module_state_key=UsageKey.from_string(record['block_id']),
+                course_id=CourseKey.from_string(record['course_id']),
+                student_id=record['user_id'],
+                state=_merge_state(None, record),
+            )
+            for record in records_by_key.values()
+        ])
+
+
+def _merge_state(state, record):
+    """
+    Returns a serialized learner state updated with a record's fields
+
+    Any compact record is dropped, so that the imported fields take effect;
+    with compact_state enabled, it is rebuilt from them on the next write.
+    """
+    state = json.loads(state or '{}')
+    state.pop(COMPACT_STATE_FIELD, None)
+    for field in STATE_FIELDS:
+        state[field] = record[field]
+    return json.dumps(state)
+
+
+def reset_attempts(learner_states):
+    """
+    Returns learner states with every attempt available again
+    """
+    return [
+        learner_state._replace(attempts=0)
+        for learner_state in learner_states
+    ]
+
+
+def rescorer(score_answers):
+    """
+    Returns an update recomputing the score of every learner state that
+    was graded, with `score_answers` mapping a list of answers to scores
+    """
+    def rescore(learner_states):
+        """
+        Returns learner states with their answers scored again
+        """
+        graded = [
+            learner_state for learner_state in learner_states
+            if learner_state.graded
+        ]
+        scores = iter(score_answers([
+            learner_state.answer for learner_state in graded
+        ]) if graded else [])
+        return [
+            learner_state._replace(score=next(scores))
+            if learner_state.graded else learner_state
+            for learner_state in learner_states
+        ]
+    return rescore
+
+
+def update_learner_states(
+        queryset,
+        update,
+        compression_threshold,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+):
+    """
+    Applies `update`, a function mapping a list of LearnerStates to their
+    new values, to every row of a StudentModule queryset, and yields the
+    (user_id, LearnerState) pairs that changed in each chunk once they
+    are written
+
+    Each chunk is written in one transaction, with its rows locked;
+    compact records are packed with `compression_threshold`, and grades
+    are not written, see publish_grades.
+    """
+    chunks = _iter_row_chunks(
+        queryset,
+        ('id', 'student_id', 'state'),
+        chunk_size,
+    )
+    for rows in chunks:
+        yield _write_chunk(
+            _update_chunk(rows, update, compression_threshold),
+            update,
+            compression_threshold,
+        )
+
+
+def update_block_learners(
+        block_id,
+        action,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        compression_threshold=None,
+):
+    """
+    Resets the attempts, or recomputes the score, of every learner of a
+    block (given as a usage key string), and returns the number of
+    learner states updated
+
+    Unless a `compression_threshold` is given, the block's configured
+    compact_state_threshold is used. Rescored grades are published one
+    chunk at a time. This is what the submit_and_compare_learners command
+    runs, and what the task configured as bulk_update_task is expected to
+    run.
+    """
+    # pylint: disable=protected-access
+    if action not in BULK_ACTIONS:
+        raise ValueError('Unknown action: {}'.format(action))
+    block = None
+    if action == 'rescore' or compression_threshold is None:
+        block = _load_block(block_id)
+    if compression_threshold is None:
+        compression_threshold = block._get_compression_threshold()
+    if action == 'reset':
+        update = reset_attempts
+    else:
+        # Scores answers exactly as student_submit does
+        update = rescorer(block._score_answers)
+    updated = 0
+    chunks = update_learner_states(
+        get_learner_states(block_id=block_id),
+        update,
+        compression_threshold,
+        chunk_size=chunk_size,
+    )
+    for changes in chunks:
+        updated += len(changes)
+        if action == 'rescore':
+            publish_grades(block, changes)
+    return updated
+
+
+def publish_grades(block, learner_states):
+    """
+    Publishes the score of each of a list of (user_id, LearnerState)
+    pairs, as the LMS does for the grade events of a block, so that
+    learners' persisted and course grades are updated
+    """
+    from django.contrib.auth.models import User
+    # pylint: disable=import-error
+    from lms.djangoapps.grades.signals.signals import SCORE_PUBLISHED
+    users = User.objects.in_bulk([user_id for user_id, _ in learner_states])
+    for user_id, learner_state in learner_states:
+        if user_id not in users:
+            continue
+        SCORE_PUBLISHED.send(
+            sender=None,
+            block=block,
+            user=users[user_id],
+            raw_earned=learner_state.score,
+            raw_possible=1.0,
+            only_if_higher=False,
+            score_deleted=False,
+        )
+
+
+def _load_block(block_id):
+    """
+    Returns the block with a usage key, from the modulestore, raising
+    ValueError if there is none
+    """
+    # pylint: disable=import-error
+    from opaque_keys.edx.keys import UsageKey
+    from xmodule.modulestore.django import modulestore
+    from xmodule.modulestore.exceptions import ItemNotFoundError
+    try:
+        return modulestore().get_item(UsageKey.from_string(block_id))
+    except ItemNotFoundError:
+        raise ValueError('No such block: {}'.format(block_id))
+
+
+def _get_learner_state(state):
+    """
+    Returns the LearnerState held in a deserialized learner state
+    """
+    learner_state = unpack_learner_state(state.get(COMPACT_STATE_FIELD))
+    if learner_state is None:
+        learner_state = LearnerState(
+            answer=state.get('student_answer', u''),
+            attempts=state.get('count_attempts', 0),
+            score=state.get('score', 0.0),
+            graded='score' in state,
+        )
+    return learner_state
+
+
+def _set_learner_state(state, learner_state, compression_threshold):
+    """
+    Stores a LearnerState in a deserialized learner state, in the fields
+    it was read from
+    """
+    if unpack_learner_state(state.get(COMPACT_STATE_FIELD)) is not None:
+        state[COMPACT_STATE_FIELD] = pack_learner_state(
+            learner_state,
+            threshold=compression_threshold,
+        )
+    else:
+        state['student_answer'] = learner_state.answer
+        state['count_attempts'] = learner_state.attempts
+        if learner_state.graded:
+            state['score'] = learner_state.score
+
+
+def _update_chunk(rows, update, compression_threshold):
+    """
+    Applies an update to a chunk of rows, returning a _RowChange for each
+    row that changed
+    """
+    parsed = []
+    for row in rows:
+        try:
+            parsed.append((row, json.loads(row['state'] or '{}')))
+        except ValueError:
+            LOG.warning('Skipping invalid learner state: %r', row['state'])
+    learner_states = [_get_learner_state(state) for _, state in parsed]
+    changes = []
+    for (row, state), before, after in zip(
+            parsed,
+            learner_states,
+            update(learner_states),
+    ):
+        if after != before:
+            _set_learner_state(state, after, compression_threshold)
+            changes.append(_RowChange(
+                id=row['id'],
+                user_id=row['student_id'],
+                old_state=row['state'],
+                state=json.dumps(state),
+                learner_state=after,
+            ))
+    return changes
+
+
+def _write_chunk(changes, update, compression_threshold):
+    """
+    Writes the changed states of a chunk of rows, in one transaction with
+    the rows locked, and returns the (user_id, LearnerState) of each
+
+    Rows whose state changed since they were read, e.g. because the learner
+    submitted meanwhile, are updated again from their current state rather
+    than overwritten.
+    """
+    from django.db import transaction
+    if not changes:
+        return []
+    student_module = _get_student_module_model()
+    with transaction.atomic():
+        rows = {
+            row['id']: row
+            for row in student_module.objects.select_for_update().filter(
+                id__in=[change.id for change in changes],
+            ).values('id', 'student_id', 'state')
+        }
+        current = []
+        stale = []
+        for change in changes:
+            row = rows.get(change.id)
+            if row is None:
+                continue
+            if row['state'] == change.old_state:
+                current.append(change)
+            else:
+                stale.append(row)
+        current.extend(_update_chunk(stale, update, compression_threshold))
+        for batch in _batches_by_size(current, MAX_UPDATE_BYTES):
+            _write_states(student_module, batch)
+    return [(change.user_id, change.learner_state) for change in current]
+
+
+def _write_states(student_module, changes):
+    """
+    Writes the state of rows in a single UPDATE statement
+    """
+    from django.db.models import Case, TextField, Value, When
+    student_module.objects.filter(
+        id__in=[change.id for change in changes],
+    ).update(
+        state=Case(
+            *[
+                When(id=change.id, then=Value(change.state))
+                for change in changes
+            ],
+            output_field=TextField()
+        ),
+    )
+
+
+def _batches_by_size(changes, max_bytes):
+    """
+    Yields lists of changes whose states add up to at most max_bytes,
+    except for single states larger than that
+    """
+    batch = []
+    size = 0
+    for change in changes:
+        if batch and size + len(change.state) > max_bytes:
+            yield batch
+            batch = []
+            size = 0
+        batch.append(change)
+        size += len(change.state)
+    if batch:
+        yield batch
+
+
+def _chunks(iterable, chunk_size):
+    """
+    Yields lists of up to chunk_size items from an iterable
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class _LastWrite(object):
+    # pylint: disable=too-few-public-methods
+    """
+    A file-like object remembering only the last string written to it
+    """
+    value = None
+
+    def write(self, value):
+        """
+        Remembers value
+        """
+        self.value = value
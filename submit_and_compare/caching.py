@@ -0,0 +1,207 @@
+"""
+Process-wide caches shared by every Submit and Compare XBlock instance
+"""
+
+import hashlib
+import threading
+import time
+
+from collections import OrderedDict
+
+
+def content_key(value):
+    """
+    Returns a stable digest of a (unicode) string, suitable as a cache key
+    """
+    if isinstance(value, unicode):
+        value = value.encode('utf8')
+    return hashlib.sha1(value).hexdigest()
+
+
+class LRUCache(object):
+    """
+    A thread-safe, size-bounded mapping that evicts the least recently
+    used entry once `max_size` entries are stored
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Returns the value stored under `key`, marking it as recently used
+        """
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        """
+        Stores `value` under `key`, evicting the oldest entry if needed
+        """
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """
+        Removes every entry from the cache
+        """
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+
+class Registry(object):
+    """
+    The process-wide instances of a family of configurable implementations,
+    e.g. render caches: one instance is created for each implementation
+    and set of options, the first time it is asked for
+    """
+
+    def __init__(self, factories, description):
+        # Factories of each implementation, by the name used to configure
+        # them, called with the dict of options
+        self.factories = factories
+        self.description = description
+        self._instances = {}
+        self._lock = threading.Lock()
+
+    def get(self, kind, **options):
+        """
+        Returns the instance of the implementation named `kind` for the
+        given options, raising ValueError for unknown implementations
+        """
+        key = (kind,) + tuple(sorted(options.items()))
+        with self._lock:
+            instance = self._instances.get(key)
+            if instance is None:
+                try:
+                    factory = self.factories[kind]
+                except KeyError:
+                    raise ValueError(
+                        'Unknown {}: {}'.format(self.description, kind)
+                    )
+                instance = self._instances[key] = factory(options)
+        return instance
+
+    def clear(self):
+        """
+        Forgets every instance, and returns them
+        """
+        with self._lock:
+            instances = list(self._instances.values())
+            self._instances.clear()
+        return instances
+
+
+class MemoryRenderCache(object):
+    """
+    An in-process render cache with LRU eviction and a time-to-live
+    """
+
+    def __init__(self, max_size=1000, ttl=300):
+        self.ttl = ttl
+        self._cache = LRUCache(max_size)
+
+    def get(self, key):
+        """
+        Returns the value cached under `key`, or None if missing or expired
+        """
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.time():
+            return None
+        return value
+
+    def set(self, key, value):
+        """
+        Caches `value` under `key` for `ttl` seconds
+        """
+        self._cache.set(key, (time.time() + self.ttl, value))
+
+    def clear(self):
+        """
+        Removes every entry from the cache
+        """
+        self._cache.clear()
+
+
+class DjangoRenderCache(object):
+    """
+    A render cache stored in one of the configured Django cache backends,
+    which takes care of expiry and eviction
+    """
+    key_prefix = 'submit_and_compare.render.'
+
+    def __init__(self, alias='default', ttl=300):
+        self.alias = alias
+        self.ttl = ttl
+
+    @property
+    def _cache(self):
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    def get(self, key):
+        """
+        Returns the value cached under `key`, or None if missing or expired
+        """
+        return self._cache.get(self.key_prefix + key)
+
+    def set(self, key, value):
+        """
+        Caches `value` under `key` for `ttl` seconds
+        """
+        self._cache.set(self.key_prefix + key, value, self.ttl)
+
+    def clear(self):
+        """
+        Django caches are shared; entries are left to expire on their own
+        """
+        pass
+
+
+# Render cache implementations, by the name used to configure them
+RENDER_CACHE_BACKENDS = {
+    'memory': lambda options: MemoryRenderCache(
+        max_size=options['size'],
+        ttl=options['ttl'],
+    ),
+    'django': lambda options: DjangoRenderCache(
+        alias=options['alias'],
+        ttl=options['ttl'],
+    ),
+}
+
+_RENDER_CACHES = Registry(RENDER_CACHE_BACKENDS, 'render cache backend')
+
+
+def get_render_cache(backend, size=1000, ttl=300, alias='default'):
+    """
+    Returns the process-wide render cache for a backend and its options
+    """
+    return _RENDER_CACHES.get(backend, size=size, ttl=ttl, alias=alias)
+
+
+def clear_render_caches():
+    """
+    Empties and forgets every render cache created in this process
+    """
+    for render_cache in _RENDER_CACHES.clear():
+        render_cache.clear()
@@ -0,0 +1,156 @@
+"""
+Optional timing of the phases of Submit and Compare XBlock views and handlers
+"""
+
+import logging
+import socket
+import threading
+import time
+
+from collections import defaultdict
+
+from .caching import Registry
+
+LOG = logging.getLogger(__name__)
+
+
+class LoggingSink(object):
+    # pylint: disable=too-few-public-methods
+    """
+    Writes each timing to a logger
+    """
+
+    def __init__(self, logger=LOG, level=logging.INFO):
+        self.logger = logger
+        self.level = level
+
+    def record(self, name, duration):
+        """
+        Records that the phase `name` took `duration` seconds
+        """
+        self.logger.log(self.level, '%s took %.3fms', name, duration * 1000)
+
+
+class StatsdSink(object):
+    # pylint: disable=too-few-public-methods
+    """
+    Sends each timing as a statsd timer over UDP
+    """
+
+    def __init__(
+            self,
+            host='localhost',
+            port=8125,
+            prefix='submit_and_compare',
+    ):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def record(self, name, duration):
+        """
+        Records that the phase `name` took `duration` seconds
+        """
+        metric = '{prefix}.{name}:{value:.3f}|ms'.format(
+            prefix=self.prefix,
+            name=name,
+            value=duration * 1000,
+        )
+        try:
+            self._socket.sendto(metric.encode('utf8'), self.address)
+        except socket.error:
+            LOG.debug('Unable to send metric %s', metric, exc_info=True)
+
+
+class HistogramSink(object):
+    """
+    Keeps every timing in memory, e.g. for tests
+    """
+
+    def __init__(self):
+        self.timings = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, name, duration):
+        """
+        Records that the phase `name` took `duration` seconds
+        """
+        with self._lock:
+            self.timings[name].append(duration)
+
+    def summary(self):
+        """
+        Returns the count, total and maximum duration of every phase
+        """
+        with self._lock:
+            return {
+                name: {
+                    'count': len(durations),
+                    'total': sum(durations),
+                    'max': max(durations),
+                }
+                for name, durations in self.timings.items()
+            }
+
+    def clear(self):
+        """
+        Forgets every timing
+        """
+        with self._lock:
+            self.timings.clear()
+
+
+# Sink implementations, by the name used to configure them
+SINKS = {
+    'log': lambda options: LoggingSink(),
+    'statsd': lambda options: StatsdSink(
+        host=options['host'],
+        port=options['port'],
+        prefix=options['prefix'],
+    ),
+    'memory': lambda options: HistogramSink(),
+}
+
+_SINKS = Registry(SINKS, 'instrumentation sink')
+
+
+def get_sink(kind, host='localhost', port=8125, prefix='submit_and_compare'):
+    """
+    Returns the process-wide sink of a kind, for the given options
+    """
+    return _SINKS.get(kind, host=host, port=port, prefix=prefix)
+
+
+class PhaseTimer(object):
+    """
+    Context manager recording how long its block takes to a sink
+    """
+    __slots__ = ('sink', 'name', 'start')
+
+    def __init__(self, sink, name):
+        self.sink = sink
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.sink.record(self.name, time.time() - self.start)
+
+
+class NullTimer(object):
+    """
+    Context manager that does nothing, used when instrumentation is off
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_TIMER = NullTimer()
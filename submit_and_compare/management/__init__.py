@@ -0,0 +1,3 @@
+"""
+Django management for the Submit and Compare XBlock
+"""
@@ -0,0 +1,92 @@
+"""
+Exports or imports the answers of every learner to Submit and Compare XBlocks
+
+Examples:
+
+    ./manage.py lms submit_and_compare_answers export \
+        --course course-v1:Org+Course+Run --format jsonl --file answers.jsonl
+    ./manage.py lms submit_and_compare_answers import \
+        --format jsonl --file answers.jsonl
+"""
+import sys
+
+from django.core.management.base import BaseCommand
+
+from submit_and_compare.bulk import (
+    EXPORT_FORMATS,
+    add_chunk_size_argument,
+    get_learner_states,
+    import_learner_states,
+    iter_export_lines,
+    iter_import_records,
+    iter_learner_states,
+)
+
+
+class Command(BaseCommand):
+    """
+    Streams learner answers, attempts and scores to or from a file
+    """
+    help = __doc__.split('\n')[1]
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=('export', 'import'))
+        parser.add_argument(
+            '--course',
+            help='only export learner state for this course key',
+        )
+        parser.add_argument(
+            '--block',
+            help='only export learner state for this usage key',
+        )
+        parser.add_argument(
+            '--format',
+            choices=EXPORT_FORMATS,
+            default='csv',
+        )
+        parser.add_argument(
+            '--file',
+            help='file to export to or import from (default: stdout/stdin)',
+        )
+        add_chunk_size_argument(parser)
+
+    def handle(self, *args, **options):
+        if options['action'] == 'export':
+            self._export(options)
+        else:
+            self._import(options)
+
+    def _export(self, options):
+        """
+        Writes the learner state, one record at a time
+        """
+        records = iter_learner_states(
+            get_learner_states(
+                course_id=options['course'],
+                block_id=options['block'],
+            ),
+            chunk_size=options['chunk_size'],
+        )
+        lines = iter_export_lines(records, options['format'])
+        if options['file']:
+            with open(options['file'], 'wb') as stream:
+                stream.writelines(lines)
+        else:
+            self.stdout.writelines(lines)
+
+    def _import(self, options):
+        """
+        Restores learner state from a previous export
+        """
+        if options['file']:
+            with open(options['file'], 'rb') as stream:
+                imported = import_learner_states(
+                    iter_import_records(stream, options['format']),
+                    chunk_size=options['chunk_size'],
+                )
+        else:
+            imported = import_learner_states(
+                iter_import_records(sys.stdin, options['format']),
+                chunk_size=options['chunk_size'],
+            )
+        self.stderr.write('Imported {} learner states'.format(imported))
@@ -0,0 +1,44 @@
+"""
+Resets the attempts, or recomputes the score, of every learner of a block
+
+Examples:
+
+    ./manage.py lms submit_and_compare_learners reset \
+        --block block-v1:Org+Course+Run+type@submit-and-compare+block@1234
+    ./manage.py lms submit_and_compare_learners rescore \
+        --block block-v1:Org+Course+Run+type@submit-and-compare+block@1234
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from submit_and_compare.bulk import (
+    BULK_ACTIONS,
+    add_chunk_size_argument,
+    update_block_learners,
+)
+
+
+class Command(BaseCommand):
+    """
+    Updates the learner state and grades of a Submit and Compare XBlock
+    """
+    help = __doc__.split('\n')[1]
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=BULK_ACTIONS)
+        parser.add_argument(
+            '--block',
+            required=True,
+            help='usage key of the block whose learners are updated',
+        )
+        add_chunk_size_argument(parser)
+
+    def handle(self, *args, **options):
+        try:
+            updated = update_block_learners(
+                options['block'],
+                options['action'],
+                chunk_size=options['chunk_size'],
+            )
+        except ValueError as error:
+            raise CommandError(unicode(error))
+        self.stderr.write('Updated {} learner states'.format(updated))
@@ -0,0 +1,180 @@
+"""
+Buffering and queueing of the events published by Submit and Compare XBlocks
+"""
+
+import time
+
+from collections import deque
+
+from .caching import Registry, content_key
+
+# Events are published as soon as the block publishes them
+PUBLISH_IMMEDIATE = 'immediate'
+# Events are collected during a handler and published when it returns
+PUBLISH_BATCHED = 'batched'
+# Events are collected during a handler and handed to a publish queue
+PUBLISH_DEFERRED = 'deferred'
+
+PUBLISH_POLICIES = (
+    PUBLISH_IMMEDIATE,
+    PUBLISH_BATCHED,
+    PUBLISH_DEFERRED,
+)
+
+RATE_LIMIT_KEY_PREFIX = 'submit_and_compare.rate_limit.'
+
+# Only the last event of these types within a handler is meaningful
+COALESCED_EVENT_TYPES = (
+    'grade',
+    'problem_check',
+)
+
+
+class PublishBuffer(object):
+    """
+    Collects the events published by a block while a handler runs
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def add(self, event_type, data):
+        """
+        Adds an event to the buffer, replacing any earlier event of the same
+        type when only the latest one matters
+        """
+        if event_type in COALESCED_EVENT_TYPES:
+            self.events = [
+                event for event in self.events
+                if event[0] != event_type
+            ]
+        self.events.append((event_type, data))
+
+    def flush(self, block):
+        """
+        Publishes the buffered events through the block's runtime, in order
+        """
+        events, self.events = self.events, []
+        for event_type, data in events:
+            block.runtime.publish(block, event_type, data)
+
+    def __len__(self):
+        return len(self.events)
+
+
+class InMemoryPublishQueue(object):
+    """
+    Keeps queued events until drain() is called, e.g. in tests
+    """
+
+    def __init__(self):
+        self.pending = deque()
+
+    def put(self, usage_id, user_id, events):
+        """
+        Queues events published by a block for a user
+        """
+        self.pending.append((usage_id, user_id, list(events)))
+
+    def drain(self, publish):
+        """
+        Calls `publish` with the usage key, user id and events of every
+        queued batch, in the order they were queued
+        """
+        while self.pending:
+            publish(*self.pending.popleft())
+
+    def __len__(self):
+        return len(self.pending)
+
+
+class TaskPublishQueue(object):
+    # pylint: disable=too-few-public-methods
+    """
+    Hands queued events to a Celery-style task, i.e. any object with an
+    apply_async(args=...) method
+
+    The task is called with the usage key of the block, the user id and the
+    list of (event_type, data) pairs; it is responsible for loading the block
+    for the user and publishing them, and for retrying failed events (e.g.
+    with Celery's autoretry_for). All the events queued by one handler are
+    sent in a single task, preserving their order; ordering across tasks
+    depends on how the task is routed.
+    """
+
+    def __init__(self, task):
+        self.task = task
+
+    def put(self, usage_id, user_id, events):
+        """
+        Queues events published by a block for a user
+        """
+        self.task.apply_async(args=[usage_id, user_id, list(events)])
+
+
+def import_task(path):
+    """
+    Returns the task named by a dotted path, raising ValueError if there is
+    none or it cannot be imported
+    """
+    if not path:
+        raise ValueError('No task is configured')
+    module_name, _, name = path.rpartition('.')
+    try:
+        module = __import__(module_name, fromlist=[name])
+        return getattr(module, name)
+    except (ImportError, AttributeError, ValueError) as error:
+        raise ValueError('Unable to import task {}: {}'.format(path, error))
+
+
+# Publish queue implementations, by the name used to configure them
+PUBLISH_QUEUES = {
+    'memory': lambda options: InMemoryPublishQueue(),
+    'task': lambda options: TaskPublishQueue(import_task(options['task'])),
+}
+
+_PUBLISH_QUEUES = Registry(PUBLISH_QUEUES, 'publish queue')
+
+
+def get_publish_queue(kind, task=None):
+    """
+    Returns the process-wide publish queue of a kind, for the given options
+    """
+    return _PUBLISH_QUEUES.get(kind, task=task)
+
+
+class RateLimiter(object):
+    # pylint: disable=too-few-public-methods
+    """
+    A fixed-window rate limiter whose counters are kept in a Django cache,
+    so that a limit holds across every process sharing the cache rather
+    than in each process separately
+    """
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+
+    def acquire(self, key, rate, count=1, period=60):
+        """
+        Takes up to `count` of the `rate` events allowed for `key` (e.g.
+        a user and block) in the current window of `period` seconds, and
+        returns how many were granted
+        """
+        from django.core.cache import caches
+        cache = caches[self.alias]
+        window = int(time.time() // period)
+        cache_key = '{}{}.{}'.format(
+            RATE_LIMIT_KEY_PREFIX,
+            content_key(key),
+            window,
+        )
+        # Windows outlive their period slightly, as a window's key is only
+        # created on its first event
+        cache.add(cache_key, 0, period)
+        try:
+            used = cache.incr(cache_key, count)
+        except ValueError:
+            # Evicted since add(); the window restarts
+            cache.add(cache_key, count, period)
+            used = count
+        return max(0, min(count, rate - (used - count)))
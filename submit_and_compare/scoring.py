@@ -0,0 +1,204 @@
+"""
+Partial-credit scoring of answers by their similarity to the explanation
+
+Answers and explanations are compared as TF-IDF term vectors: terms are
+weighted by 1 + log(term frequency), times their inverse frequency across
+the sentences of the explanation, so that terms specific to one point of
+the explanation count for more than terms repeated throughout. The score
+is the cosine similarity of the two vectors, scaled so that answers at
+least `full_credit` similar get full credit.
+
+NumPy is only imported when answers are first scored by similarity; it is
+installed with the `similarity` extra:
+
+    pip install xblock-submit-and-compare[similarity]
+"""
+
+import re
+
+from collections import namedtuple
+
+from .caching import LRUCache, content_key
+
+# Answers get full credit when they are present
+SCORING_NON_EMPTY = 'non_empty'
+# Answers get partial credit by their similarity to the explanation
+SCORING_SIMILARITY = 'similarity'
+
+SCORING_MODES = (
+    SCORING_NON_EMPTY,
+    SCORING_SIMILARITY,
+)
+
+# Similarity to the explanation at which an answer gets full credit
+DEFAULT_FULL_CREDIT_SIMILARITY = 0.5
+
+# Scores are rounded to this many decimals, to keep grades readable
+SCORE_PRECISION = 2
+
+# Number of distinct explanations kept vectorized in each process
+EXPERT_MODEL_CACHE_SIZE = 512
+
+STOP_WORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'for', 'if',
+    'in', 'into', 'is', 'it', 'of', 'on', 'or', 'so', 'such', 'that', 'the',
+    'their', 'then', 'there', 'these', 'this', 'to', 'was', 'we', 'were',
+    'will', 'with', 'would',
+))
+
+_TAG_RE = re.compile(r'<[^>]*>|&\w+;')
+_SENTENCE_RE = re.compile(r'(?<=[.!?])\s+')
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+ExpertModel = namedtuple(
+    'ExpertModel',
+    [
+        # Column of each term of the explanation
+        'vocabulary',
+        # Inverse sentence frequency of each term
+        'idf',
+        # The unit-length TF-IDF vector of the explanation
+        'vector',
+    ],
+)
+
+_EXPERT_MODELS = LRUCache(EXPERT_MODEL_CACHE_SIZE)
+
+
+def _numpy():
+    """
+    Returns the numpy module, raising ImportError if it is not installed
+    """
+    import numpy
+    return numpy
+
+
+def tokenize(text):
+    """
+    Returns the lower-cased words of a (HTML) text, without stop words
+    """
+    return [
+        token for token in _TOKEN_RE.findall(_TAG_RE.sub(' ', text).lower())
+        if token not in STOP_WORDS
+    ]
+
+
+def build_expert_model(explanation):
+    """
+    Returns the ExpertModel of an explanation
+    """
+    numpy = _numpy()
+    sentences = [
+        tokenize(sentence)
+        for sentence in _SENTENCE_RE.split(_TAG_RE.sub(' ', explanation))
+    ]
+    sentences = [tokens for tokens in sentences if tokens]
+    vocabulary = {}
+    for tokens in sentences:
+        for token in tokens:
+            vocabulary.setdefault(token, len(vocabulary))
+    if not vocabulary:
+        return ExpertModel({}, numpy.zeros(0), numpy.zeros(0))
+    document_frequency = numpy.zeros(len(vocabulary))
+    for tokens in sentences:
+        document_frequency[[vocabulary[token] for token in set(tokens)]] += 1
+    idf = numpy.log((1.0 + len(sentences)) / (1.0 + document_frequency)) + 1
+    counts = _term_counts(
+        vocabulary,
+        [[token for tokens in sentences for token in tokens]],
+    )
+    return ExpertModel(vocabulary, idf, _tf_idf(counts, idf)[0])
+
+
+def get_expert_model(explanation):
+    """
+    Returns the ExpertModel of an explanation, which is built at most once
+    per process for any given explanation
+    """
+    key = content_key(explanation)
+    model = _EXPERT_MODELS.get(key)
+    if model is None:
+        model = build_expert_model(explanation)
+        _EXPERT_MODELS.set(key, model)
+    return model
+
+
+def clear_expert_models():
+    """
+    Empties the expert model cache
+    """
+    _EXPERT_MODELS.clear()
+
+
+def _term_counts(vocabulary, documents):
+    """
+    Returns the (documents x vocabulary) matrix of term counts of
+    tokenized documents, ignoring terms outside the vocabulary
+    """
+    numpy = _numpy()
+    counts = numpy.zeros((len(documents), len(vocabulary)))
+    for row, tokens in enumerate(documents):
+        columns = [
+            vocabulary[token] for token in tokens if token in vocabulary
+        ]
+        if columns:
+            counts[row] = numpy.bincount(columns, minlength=len(vocabulary))
+    return counts
+
+
+def _tf_idf(counts, idf):
+    """
+    Returns the unit-length TF-IDF vectors of a matrix of term counts
+    """
+    numpy = _numpy()
+    weights = numpy.zeros(counts.shape)
+    present = counts > 0
+    weights[present] = 1 + numpy.log(counts[present])
+    weights *= idf
+    norms = numpy.sqrt((weights ** 2).sum(axis=1))
+    norms[norms == 0] = 1
+    return weights / norms[:, numpy.newaxis]
+
+
+def similarities(explanation, answers):
+    """
+    Returns the cosine similarity of each answer to an explanation
+    """
+    numpy = _numpy()
+    model = get_expert_model(explanation)
+    if not model.vocabulary or not answers:
+        return numpy.zeros(len(answers))
+    counts = _term_counts(
+        model.vocabulary,
+        [tokenize(answer) for answer in answers],
+    )
+    return _tf_idf(counts, model.idf).dot(model.vector)
+
+
+def score_answers(
+        explanation,
+        answers,
+        full_credit=DEFAULT_FULL_CREDIT_SIMILARITY,
+):
+    """
+    Returns the score, between 0 and 1, of each of a list of answers,
+    all computed in one pass
+    """
+    numpy = _numpy()
+    scores = numpy.clip(
+        similarities(explanation, answers) / full_credit,
+        0.0,
+        1.0,
+    )
+    return [round(float(score), SCORE_PRECISION) for score in scores]
+
+
+def score_answer(
+        explanation,
+        answer,
+        full_credit=DEFAULT_FULL_CREDIT_SIMILARITY,
+):
+    """
+    Returns the score, between 0 and 1, of an answer
+    """
+    return score_answers(explanation, [answer], full_credit)[0]
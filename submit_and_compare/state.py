@@ -0,0 +1,91 @@
+"""
+Compact storage of the learner state of Submit and Compare XBlocks
+
+A learner's answer, attempt count and score are packed into a single
+versioned record instead of three separate fields, with long answers
+compressed, e.g.:
+
+    {'v': 1, 'a': u'My answer', 'n': 2, 's': 1.0}
+
+where `a` is the answer (zlib-compressed and base64-encoded when `z` is
+set), `n` the number of attempts and `s` the score, if one was saved.
+"""
+
+import base64
+import logging
+import zlib
+
+from collections import namedtuple
+
+LOG = logging.getLogger(__name__)
+
+# Bump whenever the format of the record changes
+LEARNER_STATE_VERSION = 1
+
+# Answers longer than this many bytes (UTF-8) are compressed
+DEFAULT_COMPRESSION_THRESHOLD = 1024
+
+LearnerState = namedtuple(
+    'LearnerState',
+    [
+        'answer',
+        'attempts',
+        'score',
+        # Whether a score was ever saved, i.e. a grade was published
+        'graded',
+    ],
+)
+
+EMPTY_LEARNER_STATE = LearnerState(
+    answer=u'',
+    attempts=0,
+    score=0.0,
+    graded=False,
+)
+
+
+def pack_learner_state(state, threshold=DEFAULT_COMPRESSION_THRESHOLD):
+    """
+    Returns the compact record of a LearnerState, compressing the answer
+    when it is longer than `threshold` bytes and compression pays off
+    """
+    answer = state.answer or u''
+    record = {
+        'v': LEARNER_STATE_VERSION,
+        'a': answer,
+        'n': state.attempts,
+    }
+    if state.graded:
+        record['s'] = state.score
+    encoded = answer.encode('utf8')
+    if len(encoded) > threshold:
+        compressed = base64.b64encode(zlib.compress(encoded)).decode('ascii')
+        if len(compressed) < len(encoded):
+            record['a'] = compressed
+            record['z'] = True
+    return record
+
+
+def unpack_learner_state(record):
+    """
+    Returns the LearnerState stored in a compact record, or None if the
+    record is missing or cannot be read
+    """
+    if not record:
+        return None
+    if record.get('v') != LEARNER_STATE_VERSION:
+        LOG.warning('Unknown learner state version: %r', record.get('v'))
+        return None
+    answer = record.get('a', u'')
+    if record.get('z'):
+        try:
+            answer = zlib.decompress(base64.b64decode(answer)).decode('utf8')
+        except (TypeError, ValueError, zlib.error):
+            LOG.warning('Unable to decompress learner answer', exc_info=True)
+            return None
+    return LearnerState(
+        answer=answer,
+        attempts=record.get('n', 0),
+        score=record.get('s', 0.0),
+        graded='s' in record,
+    )
@@ -1,9 +1,11 @@
 /* Javascript for submitcompareXBlock. */
-function SubmitAndCompareXBlockInitView(runtime, element) {
+function SubmitAndCompareXBlockInitView(runtime, element, initArgs) {
     
     var handlerUrl = runtime.handlerUrl(element, 'student_submit');
     var hintUrl = runtime.handlerUrl(element, 'send_hints');
-    var publishUrl = runtime.handlerUrl(element, 'publish_event');
+    var publishUrl = runtime.handlerUrl(element, 'publish_events');
+    var draftUrl = runtime.handlerUrl(element, 'save_draft');
+    var explanationUrl = runtime.handlerUrl(element, 'get_explanation');
 
     var $element = $(element);
     var $xblocksContainer = $('#seq_content');
@@ -20,6 +22,7 @@ function SubmitAndCompareXBlockInitView(runtime, element) {
     var your_answer = $element.find('.your_answer');
     var expert_answer = $element.find('.expert_answer');
     var hint_div = $element.find('.hint');
+    var explanation_div = $element.find('.explanation');
     var hint_button_holder = $element.find('.hint_button_holder');
     var submit_button_label = $element.find('.submit_button').attr('value');
         
@@ -27,29 +30,185 @@ function SubmitAndCompareXBlockInitView(runtime, element) {
     var hints;
     var hint_counter = 0;
 
+    // Events are buffered and sent in batches, see flush_events
+    var EVENT_FLUSH_DELAY = 5000;
+    var pending_events = [];
+    var flush_timer = null;
+
+    // Drafts are kept in local storage as the student types, and sent to
+    // the server at most once every draft_save_interval milliseconds
+    var draft_autosave = Boolean(initArgs && initArgs.draft_autosave);
+    var draft_save_interval = (initArgs && initArgs.draft_save_interval) || 10000;
+    var draft_timer = null;
+    var saved_draft = null;
+
+    // In lazy mode the explanation is only fetched when first shown
+    var lazy_explanation = Boolean(initArgs && initArgs.lazy_explanation);
+    var explanation_requested = false;
+
     var xblock_id = $element.attr('data-usage-id');
     var cached_answer_id = xblock_id + '_cached_answer';
     var problem_progress_id = xblock_id + '_problem_progress';
     var used_attempts_feedback_id = xblock_id + '_used_attempts_feedback';
+    // Drafts are stored per learner, as browsers may be shared
+    var user_id = (initArgs && initArgs.user_id) || '';
+    var draft_storage_key = 'submit_and_compare_draft_' + user_id + '_' + xblock_id;
+    var draft_base = null;
+    var submitted = (initArgs && initArgs.submitted !== undefined) ?
+        initArgs.submitted : answer_textarea.val() != '';
     if ($xblocksContainer.data(cached_answer_id) !== undefined) {
         answer_textarea.text($xblocksContainer.data(cached_answer_id));
         problem_progress.text($xblocksContainer.data(problem_progress_id));
         used_attempts_feedback.text($xblocksContainer.data(used_attempts_feedback_id));
+        submitted = $xblocksContainer.data(cached_answer_id) != '';
+    }
+    if (draft_autosave) {
+        var server_answer = answer_textarea.val();
+        var local_draft = load_local_draft();
+        // The local draft is only newer than the server's if it was typed
+        // over the same answer; otherwise the answer was saved or
+        // submitted elsewhere since
+        if (local_draft !== null &&
+                local_draft.base !== hash_answer(server_answer)) {
+            clear_draft();
+            local_draft = null;
+        }
+        saved_draft = server_answer;
+        draft_base = hash_answer(server_answer);
+        if (local_draft !== null) {
+            answer_textarea.val(local_draft.answer);
+            if (local_draft.answer !== server_answer) {
+                schedule_draft_save();
+            }
+        }
     }
 
-    $.ajax({
-        type: 'POST',
-        url: hintUrl,
-        data: JSON.stringify({requested: true}),
-        success: set_hints
-    });
+    if (initArgs && initArgs.hints !== undefined) {
+        set_hints(initArgs);
+    } else {
+        $.ajax({
+            type: 'POST',
+            url: hintUrl,
+            data: JSON.stringify({requested: true}),
+            success: set_hints
+        });
+    }
 
     function publish_event(data) {
-      $.ajax({
-          type: "POST",
-          url: publishUrl,
-          data: JSON.stringify(data)
-      });
+        pending_events.push(data);
+        if (flush_timer === null) {
+            flush_timer = setTimeout(flush_events, EVENT_FLUSH_DELAY);
+        }
+    }
+
+    function flush_events(unloading) {
+        clearTimeout(flush_timer);
+        flush_timer = null;
+        if (pending_events.length === 0) {
+            return;
+        }
+        var data = JSON.stringify({events: pending_events});
+        pending_events = [];
+        // Browsers cancel pending requests when the page unloads, but
+        // still deliver beacons
+        if (unloading === true && navigator.sendBeacon &&
+                navigator.sendBeacon(publishUrl, data)) {
+            return;
+        }
+        $.ajax({
+            type: "POST",
+            url: publishUrl,
+            data: data
+        });
+    }
+
+    $(window).on('beforeunload', function() {
+        flush_events(true);
+    });
+
+    function hash_answer(value) {
+        var hash = 0;
+        for (var i = 0; i < value.length; i++) {
+            hash = ((hash << 5) - hash + value.charCodeAt(i)) | 0;
+        }
+        return hash;
+    }
+
+    function load_local_draft() {
+        try {
+            var draft = JSON.parse(window.localStorage.getItem(draft_storage_key));
+            return (draft && typeof draft.answer === 'string') ? draft : null;
+        } catch (error) {
+            return null;
+        }
+    }
+
+    function store_local_draft(value) {
+        try {
+            window.localStorage.setItem(draft_storage_key, JSON.stringify({
+                answer: value,
+                base: draft_base
+            }));
+        } catch (error) {
+            // Storage is full or disabled; the server copy still applies
+        }
+    }
+
+    function clear_draft() {
+        clearTimeout(draft_timer);
+        draft_timer = null;
+        saved_draft = null;
+        try {
+            window.localStorage.removeItem(draft_storage_key);
+        } catch (error) {
+            // Nothing was stored
+        }
+    }
+
+    function schedule_draft_save() {
+        if (draft_timer === null) {
+            draft_timer = setTimeout(save_draft, draft_save_interval);
+        }
+    }
+
+    function save_draft(unloading) {
+        clearTimeout(draft_timer);
+        draft_timer = null;
+        var draft = answer_textarea.val();
+        if (draft === saved_draft) {
+            return;
+        }
+        var data = JSON.stringify({answer: draft});
+        // The local draft stays based on the last answer known to be
+        // saved, as the beacon is not answered
+        if (unloading === true && navigator.sendBeacon &&
+                navigator.sendBeacon(draftUrl, data)) {
+            return;
+        }
+        $.ajax({
+            type: 'POST',
+            url: draftUrl,
+            data: data,
+            success: function(result) {
+                if (result.result === 'success') {
+                    saved_draft = draft;
+                    draft_base = hash_answer(draft);
+                    store_local_draft(answer_textarea.val());
+                }
+            }
+        });
+    }
+
+    if (draft_autosave) {
+        answer_textarea.on('input', function() {
+            store_local_draft(answer_textarea.val());
+            schedule_draft_save();
+        });
+        $(window).on('beforeunload', function() {
+            if (draft_timer !== null) {
+                save_draft(true);
+            }
+        });
     }
 
     function pre_submit() {
@@ -62,7 +221,7 @@ function SubmitAndCompareXBlockInitView(runtime, element) {
         $xblocksContainer.data(used_attempts_feedback_id, result.used_attempts_feedback);
         problem_progress.text(result.problem_progress);
         button_holder.addClass(result.submit_class);
-        used_attempts_feedback.text(result.used_attempts_feedback);
+        used_attempts_feedback.text(result.message || result.used_attempts_feedback);
 	}
 	
 	function set_hints(result) {
@@ -73,7 +232,26 @@ function SubmitAndCompareXBlockInitView(runtime, element) {
     	}
 	}
 
+    function load_explanation() {
+        if (!lazy_explanation || explanation_requested) {
+            return;
+        }
+        explanation_requested = true;
+        $.ajax({
+            type: 'GET',
+            url: explanationUrl,
+            dataType: 'html',
+            success: function(explanation) {
+                explanation_div.html(explanation);
+            },
+            error: function() {
+                explanation_requested = false;
+            }
+        });
+    }
+
     function show_answer() {
+        load_explanation();
 		your_answer.css('display','block');
 		expert_answer.css('display','block');
 		submit_button.val('Resubmit');
@@ -107,22 +285,33 @@ function SubmitAndCompareXBlockInitView(runtime, element) {
     }
 
     $('.submit_button', element).click(function(eventObject) {
+        var answer = $('.answer',element).val();
         pre_submit();
         $.ajax({
             type: 'POST',
             url: handlerUrl,
             data: JSON.stringify(
                 {
-                    'answer': $('.answer',element).val(),
+                    'answer': answer,
                     'action': 'submit'
                 }
             ),
-            success: post_submit
+            success: function(result) {
+                // The draft is kept until the answer is saved, so that a
+                // failed or rejected submission can still be recovered
+                if (result.success) {
+                    clear_draft();
+                    saved_draft = answer;
+                    draft_base = hash_answer(answer);
+                }
+                post_submit(result);
+            }
         });
         show_answer();
 	});
 
     $('.reset_button', element).click(function(eventObject) {
+        clear_draft();
 		$('.answer',element).val('');
         $.ajax({
             type: 'POST',
@@ -143,7 +332,7 @@ function SubmitAndCompareXBlockInitView(runtime, element) {
         show_hint();
 	});
 	
-	if ($('.answer',element).val() != '') {
+	if (submitted) {
 		show_answer();
 	}
 	
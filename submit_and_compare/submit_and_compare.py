@@ -1,35 +1,181 @@
 """
 Submit and Compare XBlock main Python class
 """
+# pylint: disable=too-many-lines
 
+from collections import namedtuple
 from StringIO import StringIO
 
+import copy
+import functools
+import json
+import os
+import re
 import textwrap
 import logging
-import pkg_resources
 
-from lxml import etree
-
-from django.template import Context, Template
+from django.utils import translation
 from django.utils.translation import ungettext
 
+from webob import Response
 from xblock.core import XBlock
-from xblock.fields import Scope, String, List, Float, Integer
+from xblock.fields import Scope, String, List, Float, Integer, Dict
 from xblock.fragment import Fragment
+from xblock.mixins import XML_NAMESPACES
+from xblockutils.settings import XBlockWithSettingsMixin
+
+from .analytics import BlockAnalytics
+from .bulk import BULK_ACTIONS, DEFAULT_CHUNK_SIZE
+from .caching import LRUCache, content_key, get_render_cache
+from .instrumentation import NULL_TIMER, PhaseTimer, get_sink
+from .publishing import (
+    PUBLISH_DEFERRED,
+    PUBLISH_IMMEDIATE,
+    PUBLISH_POLICIES,
+    PublishBuffer,
+    RateLimiter,
+    get_publish_queue,
+    import_task,
+)
+from .scoring import (
+    DEFAULT_FULL_CREDIT_SIMILARITY,
+    SCORING_MODES,
+    SCORING_NON_EMPTY,
+    SCORING_SIMILARITY,
+    score_answers,
+)
+from .state import (
+    DEFAULT_COMPRESSION_THRESHOLD,
+    LearnerState,
+    pack_learner_state,
+    unpack_learner_state,
+)
 
 LOG = logging.getLogger(__name__)
 
+# Number of distinct question documents kept parsed in each process
+PARSED_QUESTION_CACHE_SIZE = 512
+
+ParsedQuestion = namedtuple(
+    'ParsedQuestion',
+    [
+        'body',
+        'explanation',
+        'hints',
+    ],
+)
+
+_PARSED_QUESTIONS = LRUCache(PARSED_QUESTION_CACHE_SIZE)
+
+# Default limits on what learners and authors may submit, in characters
+DEFAULT_MAX_ANSWER_LENGTH = 100000
+DEFAULT_MAX_QUESTION_LENGTH = 1024 * 1024
+
+# Milliseconds between autosaves of a draft answer to the server
+DEFAULT_DRAFT_SAVE_INTERVAL = 10000
+
+# Request bodies are checked against the limits above before being decoded,
+# allowing for JSON escapes (up to 6 bytes per character) and other fields
+MAX_BYTES_PER_CHARACTER = 6
+MAX_REQUEST_OVERHEAD = 4096
+
+# Question XML is parsed incrementally, in chunks of this many characters
+XML_VALIDATION_CHUNK_SIZE = 64 * 1024
+
+# lxml cannot parse text that declares its own encoding, so neither can
+# the views or OLX export; such questions are rejected when saved
+_ENCODING_DECLARATION_RE = re.compile(r'\s*<\?xml\s[^>]*\bencoding\s*=')
+
+# Bump whenever the format of the question_parts field changes
+QUESTION_PARTS_VERSION = 1
+
+# Bump whenever the student_view HTML changes shape, to retire old entries
+RENDER_CACHE_VERSION = 2
+
+# In OLX, the question's elements are children of the block's node;
+# these attributes of the question's root are set on the node, and
+# these fields are not exported
+OLX_QUESTION_ATTRIBUTES = (
+    'schema_version',
+)
+OLX_EXCLUDED_FIELDS = (
+    'question_string',
+    'question_parts',
+)
+
+# Packaged files used to render the views
+STATIC_RESOURCES = (
+    'static/css/submit_and_compare.css',
+    'static/html/submit_and_compare_edit.html',
+    'static/html/submit_and_compare_view.html',
+    'static/js/submit_and_compare_edit.js',
+    'static/js/submit_and_compare_view.js',
+)
+
+# Static resources are either inlined into every fragment, or referenced
+# by the URL of a content-hashed public copy listed in ASSET_MANIFEST
+ASSET_MODE_INLINE = 'inline'
+ASSET_MODE_URL = 'url'
+ASSET_MANIFEST = 'public/manifest.json'
+
+# The legacy field storing each part of a LearnerState, see compact_state
+LEGACY_STATE_FIELDS = {
+    'answer': 'student_answer',
+    'attempts': 'count_attempts',
+    'score': 'score',
+}
+
+_RESOURCES = {}
+_TEMPLATES = {}
+_ASSET_MANIFESTS = {}
+
 
 # Public
 def get_body(xmlstring):
-    # pylint: disable=no-member
     """
     Helper method
     """
-    tree = etree.parse(StringIO(xmlstring))
-    body = tree.xpath('/submit_and_compare/body')
-    body_string = etree.tostring(body[0], encoding='unicode')
-    return body_string
+    body = _get_cached_question(xmlstring).body
+    if body is None:
+        raise ValueError('The question must have a <body>')
+    return body
+
+
+def parse_question(xmlstring):
+    """
+    Returns the ParsedQuestion for an XML question string
+
+    The XML is parsed at most once per process for any given content;
+    subsequent calls are served from a bounded LRU cache keyed on a digest
+    of the question string.
+    """
+    return _check_question_parts(_get_cached_question(xmlstring))
+
+
+def clear_parsed_questions():
+    """
+    Empties the parsed question cache
+    """
+    _PARSED_QUESTIONS.clear()
+
+
+def warm_resource_cache():
+    """
+    Loads every static resource into the in-process resource cache
+    """
+    for path in STATIC_RESOURCES:
+        _resource_string(path)
+
+
+def clear_resource_cache():
+    """
+    Forgets all cached static resources and compiled templates, so edits
+    to the packaged files are picked up without restarting the process
+    (for development)
+    """
+    _RESOURCES.clear()
+    _TEMPLATES.clear()
+    _ASSET_MANIFESTS.clear()
 
 
 # Private
@@ -37,38 +183,231 @@ def _load_resource(resource_path):
     """
     Gets the content of a resource
     """
-    resource_content = pkg_resources.resource_string(
-        __name__,
-        resource_path,
-    )
-    return unicode(resource_content)
+    return _resource_string(resource_path)
+
+
+def _get_template(template_path):
+    """
+    Returns the compiled Django template for a resource path,
+    compiling it only the first time it is requested
+    """
+    try:
+        return _TEMPLATES[template_path]
+    except KeyError:
+        from django.template import Template
+        template = Template(_load_resource(template_path))
+        _TEMPLATES[template_path] = template
+        return template
+
+
+def _get_asset_manifest():
+    """
+    Returns the public, content-hashed copy of each static resource,
+    as written by `python setup.py build_assets`, or {} if none was built
+    """
+    try:
+        return _ASSET_MANIFESTS[ASSET_MANIFEST]
+    except KeyError:
+        import pkg_resources
+        try:
+            manifest = json.loads(
+                pkg_resources.resource_string(__name__, ASSET_MANIFEST)
+            )
+        except (IOError, OSError, ValueError):
+            LOG.warning(
+                'No asset manifest found, static resources will be inlined; '
+                'run `python setup.py build_assets` to build it'
+            )
+            manifest = {}
+        _ASSET_MANIFESTS[ASSET_MANIFEST] = manifest
+        return manifest
 
 
 def _render_template(template_path, context):
     """
     Evaluate a template by resource path, applying the provided context
     """
-    template_str = _load_resource(template_path)
-    return Template(template_str).render(Context(context))
+    from django.template import Context
+    return _get_template(template_path).render(Context(context))
 
 
 def _resource_string(path):
     """
     Handy helper for getting resources from our kit.
+    Each resource is read and decoded once per process.
     """
-    data = pkg_resources.resource_string(__name__, path)
-    return data.decode('utf8')
+    try:
+        return _RESOURCES[path]
+    except KeyError:
+        import pkg_resources
+        data = pkg_resources.resource_string(__name__, path)
+        resource = _RESOURCES[path] = data.decode('utf8')
+        return resource
+
 
+def _get_cached_question(xmlstring):
+    """
+    Returns the ParsedQuestion for an XML question string, from the cache
+    of parsed questions, without checking that it has a body and an
+    explanation
+    """
+    key = content_key(xmlstring)
+    parsed_question = _PARSED_QUESTIONS.get(key)
+    if parsed_question is None:
+        parsed_question = _parse_question(xmlstring)
+        _PARSED_QUESTIONS.set(key, parsed_question)
+    return parsed_question
 
-def _get_explanation(xmlstring):
+
+def _parse_question(xmlstring):
     # pylint: disable=no-member
     """
-    Helper method
+    Extracts the body, explanation and hints from a single parse of the XML
+    """
+    from lxml import etree
+    return _get_question_parts(etree.parse(StringIO(xmlstring)).getroot())
+
+
+def _get_question_parts(root):
+    # pylint: disable=no-member
+    """
+    Extracts the body, explanation and hints from a parsed question, in one
+    walk over the children of the root rather than one XPath expression per
+    element
+
+    The body and the explanation are None if the question has none; the
+    hints are those of every <demandhint>.
+    """
+    from lxml import etree
+    if root.tag != 'submit_and_compare':
+        raise ValueError('The question must be a <submit_and_compare> element')
+    body = explanation = None
+    raw_hints = []
+    for element in root.iterchildren(tag=etree.Element):
+        if element.tag == 'body' and body is None:
+            body = etree.tostring(element, encoding='unicode')
+        elif element.tag == 'explanation' and explanation is None:
+            explanation = etree.tostring(element, encoding='unicode')
+        elif element.tag == 'demandhint':
+            raw_hints.extend(element.iterchildren(tag='hint'))
+    return ParsedQuestion(
+        body=body,
+        explanation=explanation,
+        hints=tuple(
+            etree.tostring(raw_hint, encoding='unicode')
+            for raw_hint in raw_hints
+        ),
+    )
+
+
+def _check_question_parts(parsed_question):
+    """
+    Returns a ParsedQuestion, raising ValueError if it has no body or no
+    explanation
+    """
+    if parsed_question.body is None or parsed_question.explanation is None:
+        raise ValueError(
+            'The question must have a <body> and an <explanation>'
+        )
+    return parsed_question
+
+
+def _serialize_question_parts(question_string, parsed_question):
+    """
+    Returns the value of the question_parts field for a question
+    """
+    return {
+        'version': QUESTION_PARTS_VERSION,
+        'digest': content_key(question_string),
+        'body': parsed_question.body,
+        'explanation': parsed_question.explanation,
+        'hints': list(parsed_question.hints),
+    }
+
+
+def _buffer_publishes(handler):
+    """
+    Decorates a handler so that the events it publishes are delivered
+    according to the configured publish_policy
+    """
+    @functools.wraps(handler)
+    def wrapper(self, *args, **kwargs):
+        # pylint: disable=protected-access
+        """
+        Collects the events published by the handler, then flushes them
+        """
+        policy = self._get_setting('publish_policy', PUBLISH_IMMEDIATE)
+        if policy not in PUBLISH_POLICIES:
+            LOG.warning('Unknown publish_policy: %s', policy)
+            policy = PUBLISH_IMMEDIATE
+        if policy == PUBLISH_IMMEDIATE:
+            return handler(self, *args, **kwargs)
+        publish_buffer = self._publish_buffer = PublishBuffer()
+        try:
+            result = handler(self, *args, **kwargs)
+        finally:
+            self._publish_buffer = None
+        if policy == PUBLISH_DEFERRED:
+            self._defer_events(publish_buffer)
+        else:
+            publish_buffer.flush(self)
+        return result
+    return wrapper
+
+
+def _limit_request_size(setting_name, default, error):
     """
-    tree = etree.parse(StringIO(xmlstring))
-    explanation = tree.xpath('/submit_and_compare/explanation')
-    explanation_string = etree.tostring(explanation[0], encoding='unicode')
-    return explanation_string
+    Decorates a handler so that requests whose body cannot fit within the
+    length limit configured by `setting_name` are rejected before their
+    JSON is decoded, answering with the JSON `error` instead
+    """
+    def decorator(handler):
+        """
+        Wraps the handler
+        """
+        @functools.wraps(handler)
+        def wrapper(self, request, suffix=''):
+            # pylint: disable=protected-access
+            """
+            Checks the size of the request body
+            """
+            max_length = self._get_setting(setting_name, default)
+            max_size = (
+                max_length * MAX_BYTES_PER_CHARACTER + MAX_REQUEST_OVERHEAD
+            )
+            if max_length > 0 and len(request.body) > max_size:
+                return Response(
+                    json.dumps(error),
+                    content_type='application/json',
+                    charset='utf8',
+                )
+            return handler(self, request, suffix)
+        return wrapper
+    return decorator
+
+
+def _parse_xml_incrementally(xml_content):
+    # pylint: disable=no-member
+    """
+    Parses a string of XML, raising XMLSyntaxError if it is not well-formed,
+    and returns its root element
+
+    The content is fed to a pull parser in chunks, so malformed content is
+    rejected as soon as the chunk holding the error is read. Unlike
+    etree.parse, the pull parser accepts text with an encoding declaration,
+    so ValueError is raised for those here.
+    """
+    from lxml import etree
+    if isinstance(xml_content, unicode) and \
+            _ENCODING_DECLARATION_RE.match(xml_content):
+        raise ValueError('The question XML must not declare an encoding')
+    parser = etree.XMLPullParser(events=('end',))
+    for start in range(0, len(xml_content), XML_VALIDATION_CHUNK_SIZE):
+        parser.feed(xml_content[start:start + XML_VALIDATION_CHUNK_SIZE])
+        # The events are not needed, only the tree being built
+        for _ in parser.read_events():
+            pass
+    return parser.close()
 
 
 def _convert_to_int(value_string):
@@ -79,7 +418,8 @@ def _convert_to_int(value_string):
     return value
 
 
-class SubmitAndCompareXBlock(XBlock):
+@XBlock.wants('settings')
+class SubmitAndCompareXBlock(XBlockWithSettingsMixin, XBlock):
     #  pylint: disable=too-many-ancestors, too-many-instance-attributes
     """
     Enables instructors to create questions with submit and compare responses.
@@ -107,6 +447,12 @@ class SubmitAndCompareXBlock(XBlock):
         help='This is the student\'s answer to the question',
     )
 
+    draft_answer = String(
+        default='',
+        scope=Scope.user_state,
+        help='The student\'s unsubmitted answer, saved while typing',
+    )
+
     max_attempts = Integer(
         default=0,
         scope=Scope.settings,
@@ -178,11 +524,30 @@ class SubmitAndCompareXBlock(XBlock):
             </submit_and_compare>
         """))
 
+    question_parts = Dict(
+        default={},
+        scope=Scope.content,
+        help=(
+            'The body, explanation and hints of question_string, '
+            'serialized when the question was saved'
+        ),
+    )
+
     score = Float(
         default=0.0,
         scope=Scope.user_state,
     )
 
+    learner_state = Dict(
+        default={},
+        scope=Scope.user_state,
+        help=(
+            'The student\'s answer, attempts and score packed into one '
+            'record, replacing student_answer, count_attempts and score '
+            'when compact_state is enabled'
+        ),
+    )
+
     weight = Integer(
         display_name='Weight',
         help='This assigns an integer value representing '
@@ -193,6 +558,15 @@ class SubmitAndCompareXBlock(XBlock):
 
     has_score = True
 
+    # Collects published events while a handler runs, see _buffer_publishes
+    _publish_buffer = None
+
+    # Where phase timings go, resolved on first use, see _time
+    _instrumentation_sink = False
+
+    # The learner_state record last unpacked, and its LearnerState
+    _unpacked_learner_state = (None, None)
+
     """
     Main functions
     """
@@ -206,44 +580,123 @@ class SubmitAndCompareXBlock(XBlock):
         The primary view of the XBlock, shown to students
         when viewing courses.
         """
-        problem_progress = self._get_problem_progress()
-        used_attempts_feedback = self._get_used_attempts_feedback()
-        submit_class = self._get_submit_class()
-        prompt = get_body(self.question_string)
-        explanation = _get_explanation(
-            self.question_string
-        )
-        attributes = ''
-        html = _resource_string(
-            'static/html/submit_and_compare_view.html'
-        )
-        frag = Fragment(
-            html.format(
-                display_name=self.display_name,
-                problem_progress=problem_progress,
-                used_attempts_feedback=used_attempts_feedback,
-                submit_class=submit_class,
-                prompt=prompt,
-                student_answer=self.student_answer,
-                explanation=explanation,
-                your_answer_label=self.your_answer_label,
-                our_answer_label=self.our_answer_label,
-                submit_button_label=self.submit_button_label,
-                attributes=attributes,
+        with self._time('student_view'):
+            return self._build_student_fragment(self._get_student_view())
+
+    @classmethod
+    def render_student_views(cls, blocks, context=None):
+        # pylint: disable=unused-argument, protected-access
+        """
+        Renders the student view of many blocks at once, e.g. every
+        Submit and Compare XBlock in a unit, returning one Fragment per
+        block in the same order.
+        The shared CSS and JS are only added to the first Fragment,
+        and identical question content is only looked up once.
+        """
+        parsed_questions = {}
+        fragments = []
+        for block in blocks:
+            question_string = block.question_string
+            if question_string not in parsed_questions:
+                parsed_questions[question_string] = (
+                    block._get_parsed_question()
+                )
+            view = block._get_student_view(
+                parsed_questions[question_string]
             )
-        )
-        frag.add_css(
-            _resource_string(
-                'static/css/submit_and_compare.css'
-            ),
-        )
-        frag.add_javascript(
-            _resource_string(
-                'static/js/submit_and_compare_view.js'
-            ),
-        )
-        frag.initialize_js('SubmitAndCompareXBlockInitView')
-        return frag
+            fragments.append(
+                block._build_student_fragment(
+                    view,
+                    include_resources=not fragments,
+                )
+            )
+        return fragments
+
+    @classmethod
+    def parse_xml(cls, node, runtime, keys, id_generator):
+        """
+        Builds a block from its OLX, where the elements of the question
+        (body, explanation and demandhint) are children of the block's node
+
+        The question is assembled from the already parsed elements, so the
+        question XML is serialized once and never parsed again. OLX that
+        stores the question in a question_string attribute, as exported by
+        earlier versions, is imported as before.
+        """
+        from lxml import etree
+        if node.get('question_string') is not None or \
+                node.find('body') is None:
+            block = super(SubmitAndCompareXBlock, cls).parse_xml(
+                node,
+                runtime,
+                keys,
+                id_generator,
+            )
+            try:
+                block.question_parts = _serialize_question_parts(
+                    block.question_string,
+                    parse_question(block.question_string),
+                )
+            except (etree.XMLSyntaxError, ValueError):
+                LOG.warning('Unable to parse question of %s', keys.usage_id)
+            return block
+
+        block = runtime.construct_xblock_from_class(cls, keys)
+        question = etree.Element('submit_and_compare')
+        question.text = node.text
+        for name, value in node.items():
+            if name in OLX_QUESTION_ATTRIBUTES:
+                question.set(name, value)
+            elif name in block.fields and name not in OLX_EXCLUDED_FIELDS:
+                cls._set_field_if_present(block, name, value, {})
+        for child in node:
+            if child.tag is not etree.Comment and \
+                    etree.QName(child).namespace == XML_NAMESPACES['option']:
+                cls._set_field_if_present(
+                    block,
+                    etree.QName(child).localname,
+                    child.text,
+                    child.attrib,
+                )
+            else:
+                question.append(copy.deepcopy(child))
+        etree.cleanup_namespaces(question)
+        question_string = etree.tostring(question, encoding='unicode')
+        block.question_string = question_string
+        try:
+            block.question_parts = _serialize_question_parts(
+                question_string,
+                _check_question_parts(_get_question_parts(question)),
+            )
+        except ValueError:
+            LOG.warning('Unable to parse question of %s', keys.usage_id)
+        return block
+
+    def add_xml_to_node(self, node):
+        """
+        Exports this block as OLX, with the elements of the question as
+        children of the block's node instead of an escaped attribute
+        """
+        from lxml import etree
+        super(SubmitAndCompareXBlock, self).add_xml_to_node(node)
+        node.attrib.pop('question_parts', None)
+        try:
+            question = etree.fromstring(self.question_string)
+        except (etree.XMLSyntaxError, ValueError):
+            # ValueError: text declaring its encoding, saved before such
+            # questions were rejected
+            LOG.warning(
+                'Exporting invalid question of %s as an attribute',
+                self.scope_ids.usage_id,
+            )
+            return
+        node.attrib.pop('question_string', None)
+        for name in OLX_QUESTION_ATTRIBUTES:
+            if question.get(name) is not None:
+                node.set(name, question.get(name))
+        node.text = question.text
+        for child in question:
+            node.append(child)
 
     def studio_view(self, context=None):
         """
@@ -265,10 +718,7 @@ class SubmitAndCompareXBlock(XBlock):
         )
 
         frag = Fragment(html)
-        resource_content = _load_resource(
-            'static/js/submit_and_compare_edit.js'
-        )
-        frag.add_javascript(resource_content)
+        self._add_javascript(frag, 'static/js/submit_and_compare_edit.js')
         frag.initialize_js('SubmitAndCompareXBlockInitEdit')
         return frag
 
@@ -282,46 +732,32 @@ class SubmitAndCompareXBlock(XBlock):
         """
         return self.weight
 
+    @_limit_request_size(
+        'max_answer_length',
+        DEFAULT_MAX_ANSWER_LENGTH,
+        {
+            'success': False,
+            'message': 'Your answer is too long',
+        },
+    )
     @XBlock.json_handler
+    @_buffer_publishes
     def student_submit(self, submissions, suffix=''):
         # pylint: disable=unused-argument
         """
         Save student answer
         """
-        # when max_attempts == 0, the user can make unlimited attempts
-        if self.max_attempts > 0 and self.count_attempts >= self.max_attempts:
-            LOG.error(
-                'User has already exceeded the maximum '
-                'number of allowed attempts',
-            )
-            result = {
-                'success': False,
-                'problem_progress': self._get_problem_progress(),
-                'submit_class': self._get_submit_class(),
-                'used_attempts_feedback': self._get_used_attempts_feedback(),
-            }
-        else:
-            self.student_answer = submissions['answer']
-
-            if submissions['action'] == 'submit':
-                self.count_attempts += 1
-
-            if self.student_answer:
-                self.score = 1.0
-            else:
-                self.score = 0.0
-
-            self._publish_grade()
-            self._publish_problem_check()
-
-            result = {
-                'success': True,
-                'problem_progress': self._get_problem_progress(),
-                'submit_class': self._get_submit_class(),
-                'used_attempts_feedback': self._get_used_attempts_feedback(),
-            }
-        return result
+        with self._time('student_submit'):
+            return self._submit(submissions)
 
+    @_limit_request_size(
+        'max_question_length',
+        DEFAULT_MAX_QUESTION_LENGTH,
+        {
+            'result': 'error',
+            'message': 'The question XML is too long',
+        },
+    )
     @XBlock.json_handler
     def studio_submit(self, submissions, suffix=''):
         # pylint: disable=unused-argument
@@ -337,66 +773,610 @@ class SubmitAndCompareXBlock(XBlock):
         self.our_answer_label = submissions['our_answer_label']
         self.submit_button_label = submissions['submit_button_label']
         xml_content = submissions['data']
+        if self._is_too_long(
+                xml_content,
+                'max_question_length',
+                DEFAULT_MAX_QUESTION_LENGTH,
+        ):
+            return {
+                'result': 'error',
+                'message': 'The question XML is too long',
+            }
+        from lxml import etree
         # pylint: disable=no-member
         try:
-            etree.parse(StringIO(xml_content))
-            self.question_string = xml_content
+            parsed_question = _check_question_parts(_get_question_parts(
+                _parse_xml_incrementally(xml_content),
+            ))
         except etree.XMLSyntaxError as error:
             return {
                 'result': 'error',
                 'message': error.message,
             }
+        except ValueError as error:
+            return {
+                'result': 'error',
+                'message': unicode(error),
+            }
+        self.question_string = xml_content
+        self.question_parts = _serialize_question_parts(
+            xml_content,
+            parsed_question,
+        )
 
         return {
             'result': 'success',
         }
 
+    @_limit_request_size(
+        'max_answer_length',
+        DEFAULT_MAX_ANSWER_LENGTH,
+        {
+            'result': 'error',
+            'message': 'Your answer is too long',
+        },
+    )
+    @XBlock.json_handler
+    def save_draft(self, data, suffix=''):
+        # pylint: disable=unused-argument
+        """
+        Save the student's unsubmitted answer, without grading it
+        """
+        draft = data.get('answer', '')
+        if self._is_too_long(
+                draft,
+                'max_answer_length',
+                DEFAULT_MAX_ANSWER_LENGTH,
+        ):
+            return {
+                'result': 'error',
+                'message': 'Your answer is too long',
+            }
+        if draft != self.draft_answer:
+            self.draft_answer = draft
+        return {
+            'result': 'success',
+        }
+
+    @XBlock.handler
+    def get_explanation(self, request, suffix=''):
+        # pylint: disable=unused-argument
+        """
+        Serve the explanation HTML, left out of student_view in lazy mode
+
+        The response carries an ETag derived from the explanation, so the
+        browser can revalidate its copy and get a 304 when it is current.
+        """
+        explanation = self._get_parsed_question().explanation
+        etag = content_key(explanation)
+        if etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            response = Response(
+                explanation,
+                content_type='text/html',
+                charset='utf8',
+            )
+        response.etag = etag
+        response.cache_control = 'private, no-cache'
+        return response
+
+    @XBlock.json_handler
+    def get_analytics(self, data, suffix=''):
+        # pylint: disable=unused-argument
+        """
+        Returns the running totals of learner activity, for instructors
+        """
+        if not self._is_staff():
+            return {
+                'result': 'error',
+                'message': 'Only course staff can see analytics',
+            }
+        result = self._get_analytics().get_totals()
+        result['result'] = 'success'
+        return result
+
+    @XBlock.json_handler
+    def bulk_update_learners(self, data, suffix=''):
+        # pylint: disable=unused-argument
+        """
+        Queues the reset of the attempts, or the rescoring, of every
+        learner, for instructors
+
+        The update runs in the task configured as bulk_update_task, since
+        it takes far longer than a request may.
+        """
+        if not self._is_staff():
+            return {
+                'result': 'error',
+                'message': 'Only course staff can update every learner',
+            }
+        action = data.get('action')
+        if action not in BULK_ACTIONS:
+            return {
+                'result': 'error',
+                'message': 'Unknown action: {}'.format(action),
+            }
+        try:
+            task = import_task(self._get_setting('bulk_update_task', None))
+        except ValueError:
+            return {
+                'result': 'error',
+                'message': (
+                    'No bulk_update_task is configured; use the '
+                    'submit_and_compare_learners command instead'
+                ),
+            }
+        task.apply_async(
+            args=[unicode(self.scope_ids.usage_id), action],
+            kwargs={
+                'chunk_size': self._get_setting(
+                    'bulk_chunk_size',
+                    DEFAULT_CHUNK_SIZE,
+                ),
+                'compression_threshold': self._get_compression_threshold(),
+            },
+        )
+        return {
+            'result': 'success',
+            'queued': True,
+        }
+
     @XBlock.json_handler
     def send_hints(self, submissions, suffix=''):
         # pylint: disable=unused-argument
-        # pylint: disable=no-member
         """
         Build hints once for user
-        This is called once on page load and
-        js loop through hints on button click
+        The hints are embedded in student_view; this handler remains
+        as a fallback for views rendered by older versions of the JS
         """
-        tree = etree.parse(StringIO(self.question_string))
-        raw_hints = tree.xpath('/submit_and_compare/demandhint/hint')
-        decorated_hints = list()
-        total_hints = len(raw_hints)
-        for i, raw_hint in enumerate(raw_hints, 1):
-            hint = u'Hint ({number} of {total}): {hint}'.format(
-                number=i,
-                total=total_hints,
-                hint=etree.tostring(raw_hint, encoding='unicode'),
-            )
-            decorated_hints.append(hint)
-        hints = decorated_hints
         return {
             'result': 'success',
-            'hints': hints,
+            'hints': self._get_decorated_hints(),
         }
 
     @XBlock.json_handler
+    @_buffer_publishes
     def publish_event(self, data, suffix=''):
         # pylint: disable=unused-argument
         """
         Publish events
         """
-        try:
-            event_type = data.pop('event_type')
-        except KeyError:
+        if 'event_type' not in data:
             return {
                 'result': 'error',
                 'message': 'Missing event_type in JSON data',
             }
+        if not self._acquire_events(1):
+            return {
+                'result': 'error',
+                'message': 'Too many events',
+            }
 
-        data['user_id'] = self.scope_ids.user_id
-        data['component_id'] = self._get_unique_id()
-        self.runtime.publish(self, event_type, data)
+        self._publish_tracking_event(data)
 
         return {'result': 'success'}
 
+    @XBlock.json_handler
+    @_buffer_publishes
+    def publish_events(self, data, suffix=''):
+        # pylint: disable=unused-argument
+        """
+        Publish a batch of events, as buffered by the student view
+        """
+        events = data.get('events', []) if isinstance(data, dict) else None
+        if not isinstance(events, list):
+            return {
+                'result': 'error',
+                'message': 'events must be a list',
+            }
+        events = [
+            event for event in events
+            if isinstance(event, dict) and 'event_type' in event
+        ]
+        granted = self._acquire_events(len(events))
+        for event in events[:granted]:
+            self._publish_tracking_event(event)
+
+        return {
+            'result': 'success',
+            'published': granted,
+            'dropped': len(events) - granted,
+        }
+
+    def _get_student_view(self, parsed_question=None):
+        """
+        Returns the HTML and JS arguments of student_view,
+        from the render cache when one is configured
+        """
+        render_cache = self._get_render_cache()
+        if render_cache is None:
+            return self._render_student_view(parsed_question)
+        cache_key = self._get_render_cache_key()
+        view = render_cache.get(cache_key)
+        if view is None:
+            view = self._render_student_view(parsed_question)
+            render_cache.set(cache_key, view)
+        return view
+
+    def _build_student_fragment(self, view, include_resources=True):
+        """
+        Wraps a rendered student view in a Fragment
+        """
+        frag = Fragment(view['html'])
+        if include_resources:
+            with self._time('student_view.assets'):
+                self._add_css(frag, 'static/css/submit_and_compare.css')
+                self._add_javascript(
+                    frag,
+                    'static/js/submit_and_compare_view.js',
+                )
+        frag.initialize_js(
+            'SubmitAndCompareXBlockInitView',
+            {
+                'hints': view['hints'],
+                'submitted': view['submitted'],
+                'lazy_explanation': self._get_setting(
+                    'lazy_explanation',
+                    False,
+                ),
+                'draft_autosave': self._get_setting('draft_autosave', False),
+                # Keeps the drafts of learners sharing a browser apart
+                'user_id': unicode(self.scope_ids.user_id),
+                'draft_save_interval': self._get_setting(
+                    'draft_save_interval',
+                    DEFAULT_DRAFT_SAVE_INTERVAL,
+                ),
+            },
+        )
+        return frag
+
+    def _get_asset_url(self, path):
+        """
+        Returns the URL of the public copy of a static resource, or None
+        when resources are inlined or no public copy was built
+        """
+        asset_mode = self._get_setting('asset_mode', ASSET_MODE_INLINE)
+        if asset_mode != ASSET_MODE_URL:
+            return None
+        public_path = _get_asset_manifest().get(path)
+        if public_path is None:
+            return None
+        return self.runtime.local_resource_url(self, public_path)
+
+    def _add_css(self, frag, path):
+        """
+        Adds a packaged stylesheet to a fragment, by URL or inline
+        """
+        url = self._get_asset_url(path)
+        if url:
+            frag.add_css_url(url)
+        else:
+            frag.add_css(_resource_string(path))
+
+    def _add_javascript(self, frag, path):
+        """
+        Adds a packaged script to a fragment, by URL or inline
+        """
+        url = self._get_asset_url(path)
+        if url:
+            frag.add_javascript_url(url)
+        else:
+            frag.add_javascript(_resource_string(path))
+
+    def _render_student_view(self, parsed_question=None):
+        """
+        Builds the HTML and JS arguments of student_view
+        """
+        if parsed_question is None:
+            with self._time('student_view.xml_extraction'):
+                parsed_question = self._get_parsed_question()
+        with self._time('student_view.formatting'):
+            return self._format_student_view(parsed_question)
+
+    def _format_student_view(self, parsed_question):
+        """
+        Formats the HTML and JS arguments of student_view
+        """
+        problem_progress = self._get_problem_progress()
+        used_attempts_feedback = self._get_used_attempts_feedback()
+        submit_class = self._get_submit_class()
+        learner_state = self._get_learner_state()
+        answer = learner_state.answer
+        if self.draft_answer and self._get_setting('draft_autosave', False):
+            answer = self.draft_answer
+        if self._get_setting('lazy_explanation', False):
+            explanation = ''
+        else:
+            explanation = parsed_question.explanation
+        attributes = ''
+        html = _resource_string(
+            'static/html/submit_and_compare_view.html'
+        )
+        return {
+            'html': html.format(
+                display_name=self.display_name,
+                problem_progress=problem_progress,
+                used_attempts_feedback=used_attempts_feedback,
+                submit_class=submit_class,
+                prompt=parsed_question.body,
+                student_answer=answer,
+                explanation=explanation,
+                your_answer_label=self.your_answer_label,
+                our_answer_label=self.our_answer_label,
+                submit_button_label=self.submit_button_label,
+                attributes=attributes,
+            ),
+            'hints': self._get_decorated_hints(parsed_question),
+            'submitted': bool(learner_state.answer),
+        }
+
+    def _get_render_cache(self):
+        """
+        Returns the configured student_view render cache, if any
+        """
+        backend = self._get_setting('render_cache', '')
+        if not backend:
+            return None
+        return get_render_cache(
+            backend,
+            size=self._get_setting('render_cache_size', 1000),
+            ttl=self._get_setting('render_cache_ttl', 300),
+            alias=self._get_setting('render_cache_alias', 'default'),
+        )
+
+    def _get_render_cache_key(self):
+        """
+        Returns a digest of everything the student_view HTML depends on
+        """
+        learner_state = self._get_learner_state()
+        state = json.dumps([
+            RENDER_CACHE_VERSION,
+            translation.get_language(),
+            self.display_name,
+            self.your_answer_label,
+            self.our_answer_label,
+            self.submit_button_label,
+            content_key(self.question_string),
+            learner_state.answer,
+            self.draft_answer,
+            self._get_setting('draft_autosave', False),
+            self._get_setting('lazy_explanation', False),
+            learner_state.score,
+            self.weight,
+            learner_state.attempts,
+            self.max_attempts,
+        ])
+        return content_key(state)
+
+    def _get_setting(self, name, default=None):
+        """
+        Returns a configuration value for this XBlock, looked up in the
+        XBlock settings bucket, then in the SUBMIT_AND_COMPARE_<NAME>
+        environment variable; environment values are converted to the
+        type of `default`
+        """
+        settings = self.get_xblock_settings(default={}) or {}
+        if name in settings:
+            return settings[name]
+        value = os.environ.get('SUBMIT_AND_COMPARE_' + name.upper())
+        if value is None:
+            return default
+        if isinstance(default, bool):
+            return value.lower() in ('1', 'true', 'yes', 'on')
+        if isinstance(default, (int, float)):
+            try:
+                return type(default)(value)
+            except ValueError:
+                LOG.warning('Invalid value for setting %s: %s', name, value)
+                return default
+        return value
+
+    def _record_submission(self, action, answer, previous_attempts):
+        """
+        Updates the running totals of learner activity with a submission
+        """
+        analytics = self._get_analytics()
+        if action == 'submit':
+            analytics.record_submission(len(answer or ''), previous_attempts)
+        else:
+            analytics.record_reset()
+
+    def _get_analytics(self):
+        """
+        Returns the running totals of learner activity on this block
+        """
+        return BlockAnalytics(
+            self.scope_ids.usage_id,
+            alias=self._get_setting('analytics_cache_alias', 'default'),
+        )
+
+    def _is_staff(self):
+        """
+        Returns True if the current user is course staff
+        """
+        return getattr(self.runtime, 'user_is_staff', False) is True
+
+    def _get_parsed_question(self):
+        """
+        Returns the ParsedQuestion for this block, from the parts stored
+        when the question was saved in studio, or by parsing question_string
+        for content saved before those were stored
+        """
+        question_string = self.question_string
+        parts = self.question_parts
+        if parts.get('version') == QUESTION_PARTS_VERSION and \
+                parts.get('digest') == content_key(question_string):
+            return ParsedQuestion(
+                body=parts['body'],
+                explanation=parts['explanation'],
+                hints=tuple(parts['hints']),
+            )
+        return parse_question(question_string)
+
+    def _get_decorated_hints(self, parsed_question=None):
+        """
+        Returns the hints for the question, prefixed with their position
+        """
+        if parsed_question is None:
+            parsed_question = self._get_parsed_question()
+        raw_hints = parsed_question.hints
+        decorated_hints = list()
+        total_hints = len(raw_hints)
+        for i, raw_hint in enumerate(raw_hints, 1):
+            hint = u'Hint ({number} of {total}): {hint}'.format(
+                number=i,
+                total=total_hints,
+                hint=raw_hint,
+            )
+            decorated_hints.append(hint)
+        return decorated_hints
+
+    def _submit(self, submissions):
+        """
+        Saves, grades and publishes a submission
+        """
+        learner_state = self._get_learner_state()
+        # when max_attempts == 0, the user can make unlimited attempts
+        if self.max_attempts > 0 and \
+                learner_state.attempts >= self.max_attempts:
+            LOG.error(
+                'User has already exceeded the maximum '
+                'number of allowed attempts',
+            )
+            result = {
+                'success': False,
+                'problem_progress': self._get_problem_progress(),
+                'submit_class': self._get_submit_class(),
+                'used_attempts_feedback': self._get_used_attempts_feedback(),
+            }
+        elif self._is_too_long(
+                submissions['answer'],
+                'max_answer_length',
+                DEFAULT_MAX_ANSWER_LENGTH,
+        ):
+            result = {
+                'success': False,
+                'message': 'Your answer is too long',
+                'problem_progress': self._get_problem_progress(),
+                'submit_class': self._get_submit_class(),
+                'used_attempts_feedback': self._get_used_attempts_feedback(),
+            }
+        else:
+            answer = submissions['answer']
+            with self._time('student_submit.scoring'):
+                score = self._score_answers([answer])[0]
+            grade_changed = not self._is_grade_unchanged(score)
+
+            with self._time('student_submit.field_writes'):
+                # Only write fields that actually change, to spare user
+                # state writes and grade signals on identical resubmissions
+                changes = {}
+                if answer != learner_state.answer:
+                    changes['answer'] = answer
+                if submissions['action'] == 'submit':
+                    changes['attempts'] = learner_state.attempts + 1
+                if grade_changed:
+                    changes['score'] = score
+                self._update_learner_state(**changes)
+
+                self._record_submission(
+                    submissions['action'],
+                    answer,
+                    learner_state.attempts,
+                )
+
+                if self.draft_answer:
+                    self.draft_answer = ''
+
+            if grade_changed:
+                with self._time('student_submit.grade_publish'):
+                    self._publish_grade()
+            with self._time('student_submit.problem_check_publish'):
+                self._publish_problem_check()
+
+            result = {
+                'success': True,
+                'problem_progress': self._get_problem_progress(),
+                'submit_class': self._get_submit_class(),
+                'used_attempts_feedback': self._get_used_attempts_feedback(),
+            }
+        return result
+
+    def _score_answers(self, answers):
+        """
+        Returns the score of each of a list of answers, according to the
+        configured scoring_mode; empty answers always score 0
+        """
+        scores = [1.0 if answer else 0.0 for answer in answers]
+        scoring_mode = self._get_setting('scoring_mode', SCORING_NON_EMPTY)
+        if scoring_mode not in SCORING_MODES:
+            LOG.warning('Unknown scoring_mode: %s', scoring_mode)
+            scoring_mode = SCORING_NON_EMPTY
+        if scoring_mode != SCORING_SIMILARITY or not any(scores):
+            return scores
+        full_credit = self._get_setting(
+            'similarity_full_credit',
+            DEFAULT_FULL_CREDIT_SIMILARITY,
+        )
+        if full_credit <= 0:
+            LOG.warning('Invalid similarity_full_credit: %s', full_credit)
+            full_credit = DEFAULT_FULL_CREDIT_SIMILARITY
+        try:
+            similarity_scores = score_answers(
+                self._get_parsed_question().explanation,
+                [answer or u'' for answer in answers],
+                full_credit=full_credit,
+            )
+        except ImportError:
+            LOG.warning(
+                'NumPy is required for similarity scoring; '
+                'scoring answers on whether they are empty instead'
+            )
+            return scores
+        return [
+            similarity if answer else 0.0
+            for answer, similarity in zip(answers, similarity_scores)
+        ]
+
+    def _is_too_long(self, value, setting_name, default):
+        """
+        Returns True if `value` is a string exceeding the length limit
+        configured by `setting_name`, if any
+        """
+        if not isinstance(value, basestring):
+            return False
+        max_length = self._get_setting(setting_name, default)
+        return max_length > 0 and len(value) > max_length
+
+    def _acquire_events(self, count):
+        """
+        Returns how many of `count` events the current user may publish
+        for this block under the configured event_rate_limit (per minute)
+        """
+        rate = self._get_setting('event_rate_limit', 60)
+        if rate <= 0:
+            return count
+        rate_limiter = RateLimiter(
+            self._get_setting('rate_limit_cache_alias', 'default'),
+        )
+        return rate_limiter.acquire(
+            u'{}.{}'.format(self.scope_ids.user_id, self._get_unique_id()),
+            rate,
+            count,
+        )
+
+    def _publish_tracking_event(self, data):
+        """
+        Publishes an event sent by the student view
+        """
+        event_type = data.pop('event_type')
+        data['user_id'] = self.scope_ids.user_id
+        data['component_id'] = self._get_unique_id()
+        if event_type == 'hint_button':
+            self._get_analytics().record_hint_click()
+        self._publish(event_type, data)
+
     def _get_unique_id(self):
         try:
             unique_id = self.location.name
@@ -417,7 +1397,7 @@ class SubmitAndCompareXBlock(XBlock):
                 'You have used {count_attempts} of {max_attempts} submissions',
                 self.max_attempts,
             ).format(
-                count_attempts=self.count_attempts,
+                count_attempts=self._get_learner_state().attempts,
                 max_attempts=self.max_attempts,
             )
         return result
@@ -427,7 +1407,8 @@ class SubmitAndCompareXBlock(XBlock):
         Returns the css class for the submit button
         """
         result = ''
-        if self.max_attempts > 0 and self.count_attempts >= self.max_attempts:
+        if self.max_attempts > 0 and \
+                self._get_learner_state().attempts >= self.max_attempts:
             result = 'nodisplay'
         return result
 
@@ -436,9 +1417,10 @@ class SubmitAndCompareXBlock(XBlock):
         Returns a statement of progress for the XBlock, which depends
         on the user's current score
         """
+        score = self._get_learner_state().score
         if self.weight == 0:
             result = ''
-        elif self.score == 0.0:
+        elif score == 0.0:
             result = "({})".format(
                 ungettext(
                     '{weight} point possible',
@@ -449,7 +1431,7 @@ class SubmitAndCompareXBlock(XBlock):
                 )
             )
         else:
-            scaled_score = self.score * self.weight
+            scaled_score = score * self.weight
             score_string = '{0:g}'.format(scaled_score)
             result = "({})".format(
                 ungettext(
@@ -462,22 +1444,179 @@ class SubmitAndCompareXBlock(XBlock):
             )
         return result
 
+    def _time(self, phase):
+        """
+        Returns a context manager timing a phase of a view or handler,
+        which does nothing unless instrumentation is configured
+        """
+        if self._instrumentation_sink is False:
+            kind = self._get_setting('instrumentation', '')
+            if kind:
+                self._instrumentation_sink = get_sink(
+                    kind,
+                    host=self._get_setting('statsd_host', 'localhost'),
+                    port=self._get_setting('statsd_port', 8125),
+                    prefix=self._get_setting(
+                        'statsd_prefix',
+                        'submit_and_compare',
+                    ),
+                )
+            else:
+                self._instrumentation_sink = None
+        if self._instrumentation_sink is None:
+            return NULL_TIMER
+        return PhaseTimer(self._instrumentation_sink, phase)
+
+    def _is_grade_unchanged(self, score):
+        """
+        Returns True if `score` has already been saved and published
+        """
+        learner_state = self._get_learner_state()
+        return learner_state.graded and learner_state.score == score
+
+    def _is_compact_state(self):
+        """
+        Returns True if learner state is stored in the learner_state record
+        """
+        return self._get_setting('compact_state', False)
+
+    def _get_learner_state(self):
+        # pylint: disable=unsubscriptable-object
+        """
+        Returns the current learner's answer, attempts and score, from the
+        learner_state record or, if there is none, the legacy fields
+        """
+        record = self.learner_state
+        cached_record, learner_state = self._unpacked_learner_state
+        if record and record is cached_record:
+            return learner_state
+        learner_state = unpack_learner_state(record)
+        if learner_state is not None:
+            self._unpacked_learner_state = (record, learner_state)
+            return learner_state
+        return LearnerState(
+            answer=self.student_answer,
+            attempts=self.count_attempts,
+            score=self.score,
+            graded=self.fields['score'].is_set_on(self),
+        )
+
+    def _update_learner_state(self, **changes):
+        """
+        Saves changes to the current learner's answer, attempts or score,
+        writing only the fields that hold them
+        """
+        if not changes:
+            return
+        if not self._is_compact_state() and not self.learner_state:
+            for name, value in changes.items():
+                setattr(self, LEGACY_STATE_FIELDS[name], value)
+            return
+        learner_state = self._get_learner_state()._replace(**changes)
+        if 'score' in changes:
+            learner_state = learner_state._replace(graded=True)
+        self._write_learner_state(learner_state)
+
+    def _get_compression_threshold(self):
+        """
+        Returns the length in bytes above which answers are compressed in
+        the compact learner state record
+        """
+        return self._get_setting(
+            'compact_state_threshold',
+            DEFAULT_COMPRESSION_THRESHOLD,
+        )
+
+    def _write_learner_state(self, learner_state):
+        # pylint: disable=unsubscriptable-object
+        """
+        Stores a LearnerState in the fields selected by compact_state,
+        clearing the fields it was previously stored in
+
+        Fields are cleared by assignment rather than deleted, since deletes
+        are written immediately while assignments are only written with
+        the new state, on save().
+        """
+        if self._is_compact_state():
+            record = pack_learner_state(
+                learner_state,
+                threshold=self._get_compression_threshold(),
+            )
+            self.learner_state = record
+            self._unpacked_learner_state = (self.learner_state, learner_state)
+            # The legacy score is left as is: it is only read when there
+            # is no record, and tells whether a grade was ever saved
+            for name in ('student_answer', 'count_attempts'):
+                default = self.fields[name].default
+                if getattr(self, name) != default:
+                    setattr(self, name, default)
+        else:
+            self.student_answer = learner_state.answer
+            self.count_attempts = learner_state.attempts
+            if learner_state.graded:
+                self.score = learner_state.score
+            if self.learner_state:
+                self.learner_state = {}
+            self._unpacked_learner_state = (None, None)
+
+    def _get_publish_queue(self):
+        """
+        Returns the queue that deferred events are handed to, or None if
+        it is not configured
+        """
+        try:
+            return get_publish_queue(
+                self._get_setting('publish_queue', 'task'),
+                task=self._get_setting('publish_task', None),
+            )
+        except ValueError as error:
+            LOG.warning('Publishing deferred events in the request: %s', error)
+            return None
+
+    def _defer_events(self, publish_buffer):
+        """
+        Hands the events of a PublishBuffer to the publish queue, with only
+        the usage key and user id of the block, or publishes them right away
+        if there is no queue
+        """
+        publish_queue = self._get_publish_queue()
+        if publish_queue is None:
+            publish_buffer.flush(self)
+        else:
+            publish_queue.put(
+                unicode(self.scope_ids.usage_id),
+                self.scope_ids.user_id,
+                publish_buffer.events,
+            )
+
+    def _publish(self, event_type, data):
+        """
+        Publishes an event, or buffers it while a handler is running
+        with a batched or deferred publish_policy
+        """
+        if self._publish_buffer is None:
+            self.runtime.publish(self, event_type, data)
+        else:
+            self._publish_buffer.add(event_type, data)
+
     def _publish_grade(self):
-        self.runtime.publish(
-            self,
+        self._publish(
             'grade',
             {
-                'value': self.score,
+                'value': self._get_learner_state().score,
                 'max_value': 1.0,
             }
         )
 
     def _publish_problem_check(self):
-        self.runtime.publish(
-            self,
+        self._publish(
             'problem_check',
             {
-                'grade': self.score,
+                'grade': self._get_learner_state().score,
                 'max_grade': 1.0,
             }
         )
+
+
+if os.environ.get('SUBMIT_AND_COMPARE_WARM_RESOURCES'):
+    warm_resource_cache()
@@ -1,17 +1,66 @@
 """
 Tests for xblock-submit-and-compare
 """
+# pylint: disable=too-many-lines
+import ast
+import io
+import json
+import os
+import socket
 import unittest
 
 import cgi
 import mock
+from lxml import etree
+from django.core.cache import caches
+from django.template import Template
+from django.db import connection, models
 from django.test.client import Client
 from django.utils.translation import ugettext as _
 from opaque_keys.edx.locations import SlashSeparatedCourseKey
+from webob import Request
 from xblock.field_data import DictFieldData
 
+from . import bulk
+from .bulk import (
+    import_learner_states,
+    iter_export_lines,
+    iter_import_records,
+    iter_learner_states,
+    rescorer,
+    reset_attempts,
+    state_to_record,
+    update_block_learners,
+    update_learner_states,
+)
+from .caching import clear_render_caches, content_key
+from .instrumentation import StatsdSink, get_sink
+from .scoring import (
+    clear_expert_models,
+    get_expert_model,
+    score_answer,
+    score_answers,
+)
+from .publishing import (
+    PublishBuffer,
+    RateLimiter,
+    TaskPublishQueue,
+    get_publish_queue,
+    import_task,
+)
+from .state import (
+    EMPTY_LEARNER_STATE,
+    LearnerState,
+    pack_learner_state,
+    unpack_learner_state,
+)
 from .submit_and_compare import SubmitAndCompareXBlock
+from .submit_and_compare import _parse_question
+from .submit_and_compare import clear_parsed_questions
+from .submit_and_compare import clear_resource_cache
 from .submit_and_compare import get_body
+from .submit_and_compare import parse_question
+from .submit_and_compare import warm_resource_cache
 
 
 class SubmitAndCompareXblockTestCase(unittest.TestCase):
@@ -25,7 +74,10 @@ class SubmitAndCompareXblockTestCase(unittest.TestCase):
         Helper method that creates a Free-text Response XBlock
         """
         course_id = SlashSeparatedCourseKey('foo', 'bar', 'baz')
+        settings_service = mock.Mock()
+        settings_service.get_settings_bucket.return_value = {}
         runtime = mock.Mock(course_id=course_id)
+        runtime.service.return_value = settings_service
         scope_ids = mock.Mock()
         field_data = DictFieldData(kw)
         xblock = SubmitAndCompareXBlock(runtime, field_data, scope_ids)
@@ -33,9 +85,20 @@ class SubmitAndCompareXblockTestCase(unittest.TestCase):
         return xblock
 
     def setUp(self):
+        clear_parsed_questions()
+        clear_render_caches()
+        clear_expert_models()
+        caches['default'].clear()
         self.xblock = SubmitAndCompareXblockTestCase.make_an_xblock()
         self.client = Client()
 
+    def configure(self, **settings):
+        """
+        Helper method that sets the XBlock settings seen by the xblock
+        """
+        settings_service = self.xblock.runtime.service.return_value
+        settings_service.get_settings_bucket.return_value = settings
+
     def test_student_view(self):
         # pylint: disable=protected-access
         """
@@ -78,6 +141,45 @@ class SubmitAndCompareXblockTestCase(unittest.TestCase):
         self.assertEquals('', self.xblock.student_answer)
         self.assertEquals(0, self.xblock.count_attempts)
 
+    def call_handler(self, handler_name, data):
+        """
+        Helper method that POSTs JSON data to a handler and
+        returns its decoded JSON response
+        """
+        request = Request.blank(
+            '/',
+            method='POST',
+            body=json.dumps(data).encode('utf8'),
+        )
+        response = getattr(self.xblock, handler_name)(request)
+        return json.loads(response.body)
+
+    def published_events(self):
+        """
+        Helper method that returns the (event_type, data) pairs
+        published through the runtime so far
+        """
+        return [
+            call[0][1:]
+            for call in self.xblock.runtime.publish.call_args_list
+        ]
+
+    def studio_data(self, **kwargs):
+        """
+        Helper method that returns the data posted by the studio view
+        """
+        data = {
+            'display_name': self.xblock.display_name,
+            'weight': str(self.xblock.weight),
+            'max_attempts': str(self.xblock.max_attempts),
+            'your_answer_label': self.xblock.your_answer_label,
+            'our_answer_label': self.xblock.our_answer_label,
+            'submit_button_label': self.xblock.submit_button_label,
+            'data': self.xblock.question_string,
+        }
+        data.update(kwargs)
+        return data
+
     def student_view_html(self):
         """
         Helper method that returns the html of student_view
@@ -199,3 +301,1551 @@ class SubmitAndCompareXblockTestCase(unittest.TestCase):
         """
         self.xblock.weight = 4
         self.assertEquals(self.xblock.weight, self.xblock.max_score())
+
+    def test_parse_question(self):
+        """
+        Tests that the body, explanation and hints are extracted together
+        """
+        parsed_question = parse_question(self.xblock.question_string)
+        self.assertTrue(parsed_question.body.startswith('<body>'))
+        self.assertIn('no difference', parsed_question.explanation)
+        self.assertEquals(2, len(parsed_question.hints))
+        self.assertIn('A hypothesis is', parsed_question.hints[0])
+
+    def test_parse_question_is_cached(self):
+        """
+        Tests that identical question content is only parsed once
+        """
+        question_string = self.xblock.question_string
+        with mock.patch(
+            'submit_and_compare.submit_and_compare._parse_question',
+            wraps=_parse_question,
+        ) as parser:
+            first = parse_question(question_string)
+            second = parse_question(question_string)
+            self.student_view_html()
+        self.assertIs(first, second)
+        self.assertEquals(1, parser.call_count)
+
+    def test_student_view_embeds_hints(self):
+        # pylint: disable=protected-access
+        """
+        Tests that the decorated hints are passed to the view's JS
+        """
+        fragment = self.xblock.student_view()
+        hints = fragment.json_init_args['hints']
+        self.assertEquals(2, len(hints))
+        self.assertTrue(hints[0].startswith('Hint (1 of 2): <hint>'))
+        self.assertEquals(
+            self.xblock._get_decorated_hints(),
+            hints,
+        )
+
+    def test_resources_are_cached(self):
+        """
+        Tests that static resources are read from the package only once
+        """
+        clear_resource_cache()
+        with mock.patch(
+            'pkg_resources.resource_string',
+            return_value=b'resource',
+        ) as resource_string:
+            warm_resource_cache()
+            calls = resource_string.call_count
+            self.student_view_html()
+            self.studio_view_html()
+            self.assertEquals(calls, resource_string.call_count)
+        clear_resource_cache()
+
+    def test_templates_are_compiled_once(self):
+        """
+        Tests that the studio template is compiled once and then reused
+        """
+        clear_resource_cache()
+        with mock.patch(
+            'django.template.Template',
+            wraps=Template,
+        ) as template:
+            first_html = self.studio_view_html()
+            second_html = self.studio_view_html()
+        self.assertEquals(1, template.call_count)
+        self.assertEquals(first_html, second_html)
+
+    def test_render_cache_disabled_by_default(self):
+        # pylint: disable=protected-access
+        """
+        Tests that student_view is rendered every time unless configured
+        """
+        with mock.patch.object(
+            SubmitAndCompareXBlock,
+            '_render_student_view',
+            wraps=self.xblock._render_student_view,
+        ) as render:
+            self.student_view_html()
+            self.student_view_html()
+        self.assertEquals(2, render.call_count)
+
+    def test_render_cache(self):
+        # pylint: disable=protected-access
+        """
+        Tests that unchanged state is served from the render cache and that
+        a change to the student's state invalidates it
+        """
+        self.configure(render_cache='memory')
+        with mock.patch.object(
+            SubmitAndCompareXBlock,
+            '_render_student_view',
+            wraps=self.xblock._render_student_view,
+        ) as render:
+            first_html = self.student_view_html()
+            self.assertEquals(first_html, self.student_view_html())
+            self.assertEquals(1, render.call_count)
+            self.xblock.student_answer = 'My new answer'
+            self.assertIn('My new answer', self.student_view_html())
+            self.assertEquals(2, render.call_count)
+
+    def test_render_cache_ttl(self):
+        """
+        Tests that render cache entries expire
+        """
+        self.configure(render_cache='memory', render_cache_ttl=-1)
+        with mock.patch.object(
+            SubmitAndCompareXBlock,
+            '_render_student_view',
+            return_value={
+                'html': u'<div></div>',
+                'hints': [],
+                'submitted': False,
+            },
+        ) as render:
+            self.student_view_html()
+            self.student_view_html()
+        self.assertEquals(2, render.call_count)
+
+    def test_setting_from_environment(self):
+        # pylint: disable=protected-access
+        """
+        Tests that settings fall back to typed environment variables
+        """
+        with mock.patch.dict('os.environ', {
+            'SUBMIT_AND_COMPARE_RENDER_CACHE_TTL': '60',
+        }):
+            self.assertEquals(
+                60,
+                self.xblock._get_setting('render_cache_ttl', 300),
+            )
+        self.configure(render_cache_ttl=30)
+        self.assertEquals(
+            30,
+            self.xblock._get_setting('render_cache_ttl', 300),
+        )
+
+    def test_render_student_views(self):
+        """
+        Tests that a batch of blocks is rendered with the shared resources
+        emitted once and identical questions parsed once
+        """
+        blocks = [self.make_an_xblock(display_name='Block {}'.format(i))
+                  for i in range(3)]
+        with mock.patch(
+            'submit_and_compare.submit_and_compare.parse_question',
+            wraps=parse_question,
+        ) as parser:
+            fragments = SubmitAndCompareXBlock.render_student_views(blocks)
+        self.assertEquals(1, parser.call_count)
+        self.assertEquals(3, len(fragments))
+        for i, fragment in enumerate(fragments):
+            self.assertIn('Block {}'.format(i), fragment.content)
+            self.assertEquals(
+                'SubmitAndCompareXBlockInitView',
+                fragment.js_init_fn,
+            )
+        self.assertEquals(2, len(fragments[0].resources))
+        self.assertEquals(0, len(fragments[1].resources))
+        self.assertEquals(0, len(fragments[2].resources))
+
+    def test_student_submit(self):
+        """
+        Tests that a submission is saved, graded and published
+        """
+        result = self.call_handler('student_submit', {
+            'answer': 'My answer',
+            'action': 'submit',
+        })
+        self.assertTrue(result['success'])
+        self.assertEquals('My answer', self.xblock.student_answer)
+        self.assertEquals(1.0, self.xblock.score)
+        self.assertEquals(1, self.xblock.count_attempts)
+        self.assertEquals(
+            [
+                ('grade', {'value': 1.0, 'max_value': 1.0}),
+                ('problem_check', {'grade': 1.0, 'max_grade': 1.0}),
+            ],
+            self.published_events(),
+        )
+
+    def test_publish_policy_batched(self):
+        # pylint: disable=protected-access
+        """
+        Tests that batched events are only published once the handler
+        has finished
+        """
+        self.configure(publish_policy='batched')
+        published_during_handler = []
+        original_submit = self.xblock._get_submit_class
+
+        def get_submit_class():
+            """
+            Records the events published while the handler is running
+            """
+            published_during_handler.extend(self.published_events())
+            return original_submit()
+
+        with mock.patch.object(
+            self.xblock,
+            '_get_submit_class',
+            side_effect=get_submit_class,
+        ):
+            self.call_handler('student_submit', {
+                'answer': 'My answer',
+                'action': 'submit',
+            })
+        self.assertEquals([], published_during_handler)
+        self.assertEquals(
+            ['grade', 'problem_check'],
+            [event[0] for event in self.published_events()],
+        )
+
+    def test_publish_buffer_coalesces_grades(self):
+        """
+        Tests that only the last grade published by a handler is kept
+        """
+        publish_buffer = PublishBuffer()
+        publish_buffer.add('grade', {'value': 0.0})
+        publish_buffer.add('hint_button', {})
+        publish_buffer.add('grade', {'value': 1.0})
+        publish_buffer.flush(self.xblock)
+        self.assertEquals(
+            [('hint_button', {}), ('grade', {'value': 1.0})],
+            self.published_events(),
+        )
+
+    def test_publish_policy_deferred(self):
+        """
+        Tests that deferred events are handed to the publish queue with
+        only the usage key and user id of the block
+        """
+        self.configure(publish_policy='deferred', publish_queue='memory')
+        queue = get_publish_queue('memory')
+        self.call_handler('student_submit', {
+            'answer': 'My answer',
+            'action': 'submit',
+        })
+        self.assertEquals([], self.published_events())
+        self.assertEquals(1, len(queue))
+        publish = mock.Mock()
+        queue.drain(publish)
+        usage_id, user_id, events = publish.call_args[0]
+        self.assertEquals(unicode(self.xblock.scope_ids.usage_id), usage_id)
+        self.assertEquals(self.xblock.scope_ids.user_id, user_id)
+        self.assertEquals(
+            ['grade', 'problem_check'],
+            [event[0] for event in json.loads(json.dumps(events))],
+        )
+
+    def test_publish_policy_deferred_without_task(self):
+        """
+        Tests that deferred events are published in the request until a
+        publish task is configured
+        """
+        self.configure(publish_policy='deferred')
+        self.call_handler('student_submit', {
+            'answer': 'My answer',
+            'action': 'submit',
+        })
+        self.assertEquals(
+            ['grade', 'problem_check'],
+            [event[0] for event in self.published_events()],
+        )
+
+    def test_publish_policy_deferred_bad_task(self):
+        """
+        Tests that deferred events are published in the request when the
+        publish task cannot be imported, and that failures to publish them
+        are not hidden
+        """
+        self.configure(
+            publish_policy='deferred',
+            publish_task='submit_and_compare.tests.NO_SUCH_TASK',
+        )
+        self.call_handler('student_submit', {
+            'answer': 'My answer',
+            'action': 'submit',
+        })
+        self.assertEquals(
+            ['grade', 'problem_check'],
+            [event[0] for event in self.published_events()],
+        )
+        self.xblock.runtime.publish.side_effect = IOError
+        with self.assertRaises(IOError):
+            self.call_handler('student_submit', {
+                'answer': 'My other answer',
+                'action': 'submit',
+            })
+
+    def test_import_task(self):
+        """
+        Tests that tasks which cannot be imported raise ValueError
+        """
+        self.assertIs(
+            BULK_UPDATE_TASK,
+            import_task('submit_and_compare.tests.BULK_UPDATE_TASK'),
+        )
+        for path in (None, 'no_such_module.task', 'submit_and_compare.x',
+                     'task'):
+            with self.assertRaises(ValueError):
+                import_task(path)
+
+    def test_task_publish_queue(self):
+        """
+        Tests that events can be handed to a Celery-style task
+        """
+        task = mock.Mock()
+        queue = TaskPublishQueue(task)
+        queue.put(u'block-v1:a+b+c', 7, [('grade', {'value': 1.0})])
+        self.assertEquals(
+            [
+                mock.call(
+                    args=[u'block-v1:a+b+c', 7, [('grade', {'value': 1.0})]],
+                ),
+            ],
+            task.apply_async.call_args_list,
+        )
+
+    def test_identical_resubmission(self):
+        # pylint: disable=protected-access
+        """
+        Tests that resubmitting the same answer counts the attempt but does
+        not rewrite the answer and score or republish the grade
+        """
+        submission = {
+            'answer': 'My answer',
+            'action': 'submit',
+        }
+        self.call_handler('student_submit', submission)
+        self.xblock.save()
+        self.xblock.runtime.publish.reset_mock()
+        self.call_handler('student_submit', submission)
+        self.assertEquals(2, self.xblock.count_attempts)
+        self.assertEquals(
+            ['problem_check'],
+            [event[0] for event in self.published_events()],
+        )
+        self.assertEquals(
+            set(['count_attempts']),
+            set(self.xblock._get_fields_to_save()),
+        )
+
+    def test_first_empty_submission_is_graded(self):
+        """
+        Tests that the first grade is published even if it is zero
+        """
+        self.call_handler('student_submit', {
+            'answer': '',
+            'action': 'submit',
+        })
+        self.assertEquals(
+            ['grade', 'problem_check'],
+            [event[0] for event in self.published_events()],
+        )
+
+    def test_publish_events(self):
+        """
+        Tests that a batch of events is published in one request
+        """
+        result = self.call_handler('publish_events', {
+            'events': [
+                {'event_type': 'hint_button', 'next_hint_index': 0},
+                {'event_type': 'hint_button', 'next_hint_index': 1},
+                {'next_hint_index': 2},
+            ],
+        })
+        self.assertEquals('success', result['result'])
+        self.assertEquals(2, result['published'])
+        events = self.published_events()
+        self.assertEquals(
+            ['hint_button', 'hint_button'],
+            [event[0] for event in events],
+        )
+        self.assertEquals(1, events[1][1]['next_hint_index'])
+        self.assertIn('user_id', events[1][1])
+
+    def test_publish_events_not_a_list(self):
+        """
+        Tests that malformed batches are rejected without publishing
+        """
+        for data in ({'events': {'event_type': 'hint_button'}}, ['events']):
+            result = self.call_handler('publish_events', data)
+            self.assertEquals('error', result['result'])
+        self.assertEquals([], self.published_events())
+
+    def test_publish_event_rate_limit(self):
+        """
+        Tests that events beyond the configured rate are dropped
+        """
+        self.configure(event_rate_limit=3)
+        result = self.call_handler('publish_events', {
+            'events': [{'event_type': 'hint_button'}] * 5,
+        })
+        self.assertEquals(3, result['published'])
+        self.assertEquals(2, result['dropped'])
+        result = self.call_handler('publish_event', {
+            'event_type': 'hint_button',
+        })
+        self.assertEquals('error', result['result'])
+        self.assertEquals(3, len(self.published_events()))
+
+    def test_rate_limiter_is_shared(self):
+        """
+        Tests that rate limiters using the same cache, e.g. in different
+        processes, share their counts
+        """
+        with mock.patch('time.time', return_value=6000.0):
+            self.assertEquals(2, RateLimiter().acquire(u'7.block', 3, 2))
+            self.assertEquals(1, RateLimiter().acquire(u'7.block', 3, 2))
+            self.assertEquals(0, RateLimiter().acquire(u'7.block', 3))
+            self.assertEquals(1, RateLimiter().acquire(u'8.block', 3))
+        with mock.patch('time.time', return_value=6060.0):
+            self.assertEquals(1, RateLimiter().acquire(u'7.block', 3))
+
+    def test_student_submit_too_long(self):
+        """
+        Tests that answers over the configured length are not saved
+        """
+        self.configure(max_answer_length=10)
+        result = self.call_handler('student_submit', {
+            'answer': 'x' * 11,
+            'action': 'submit',
+        })
+        self.assertFalse(result['success'])
+        self.assertEquals('', self.xblock.student_answer)
+        self.assertEquals(0, self.xblock.count_attempts)
+        self.assertEquals([], self.published_events())
+
+    def test_student_submit_null_answer(self):
+        # pylint: disable=protected-access
+        """
+        Tests that a null answer is accepted as an empty one, as it
+        always was
+        """
+        for compact_state in (False, True):
+            self.xblock = self.make_an_xblock()
+            self.configure(compact_state=compact_state)
+            result = self.call_handler('student_submit', {
+                'answer': None,
+                'action': 'submit',
+            })
+            self.assertTrue(result['success'])
+            self.assertEquals(1, self.xblock._get_learner_state().attempts)
+            self.assertEquals(
+                'success',
+                self.call_handler('save_draft', {'answer': None})['result'],
+            )
+
+    def test_oversized_request_not_decoded(self):
+        # pylint: disable=no-member
+        """
+        Tests that oversized request bodies are rejected before decoding
+        """
+        self.configure(max_answer_length=10)
+        with mock.patch('json.loads', wraps=json.loads) as loads:
+            response = self.xblock.student_submit(Request.blank(
+                '/',
+                method='POST',
+                body=b'{"answer": "' + b'x' * 10000 + b'"}',
+            ))
+            self.assertEquals(0, loads.call_count)
+        self.assertFalse(json.loads(response.body)['success'])
+
+    def test_studio_submit(self):
+        """
+        Tests that valid question XML is saved from studio
+        """
+        question_string = self.xblock.question_string.replace(
+            'Before you begin', 'Before we begin',
+        )
+        result = self.call_handler('studio_submit', self.studio_data(
+            data=question_string,
+        ))
+        self.assertEquals('success', result['result'])
+        self.assertEquals(question_string, self.xblock.question_string)
+
+    def test_studio_submit_invalid_xml(self):
+        """
+        Tests that malformed or oversized question XML is rejected
+        """
+        question_string = self.xblock.question_string
+        result = self.call_handler('studio_submit', self.studio_data(
+            data='<submit_and_compare><body></submit_and_compare>',
+        ))
+        self.assertEquals('error', result['result'])
+        result = self.call_handler('studio_submit', self.studio_data(
+            data=u"<?xml version='1.0' encoding='utf-8'?>\n" + question_string,
+        ))
+        self.assertEquals('error', result['result'])
+        self.configure(max_question_length=100)
+        result = self.call_handler('studio_submit', self.studio_data(
+            data='<submit_and_compare>{}</submit_and_compare>'.format(
+                'x' * 100,
+            ),
+        ))
+        self.assertEquals('error', result['result'])
+        self.assertEquals(question_string, self.xblock.question_string)
+
+    def test_instrumentation(self):
+        """
+        Tests that the phases of views and handlers are timed when
+        instrumentation is configured
+        """
+        self.configure(instrumentation='memory')
+        sink = get_sink('memory')
+        sink.clear()
+        self.student_view_html()
+        self.call_handler('student_submit', {
+            'answer': 'My answer',
+            'action': 'submit',
+        })
+        timings = sink.summary()
+        for phase in (
+                'student_view',
+                'student_view.xml_extraction',
+                'student_view.assets',
+                'student_view.formatting',
+                'student_submit',
+                'student_submit.field_writes',
+                'student_submit.grade_publish',
+                'student_submit.problem_check_publish',
+        ):
+            self.assertEquals(1, timings[phase]['count'])
+
+    def test_statsd_sink(self):
+        """
+        Tests that the statsd sink sends timers over UDP
+        """
+        listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.settimeout(5)
+        try:
+            sink = StatsdSink(
+                host='127.0.0.1',
+                port=listener.getsockname()[1],
+                prefix='test',
+            )
+            sink.record('student_view', 0.0125)
+            metric = listener.recv(1024)
+        finally:
+            listener.close()
+        self.assertEquals(b'test.student_view:12.500|ms', metric)
+
+    def test_parse_question_without_hints(self):
+        """
+        Tests that questions without a demandhint section have no hints,
+        and that comments are skipped while extracting
+        """
+        parsed_question = parse_question(
+            '<submit_and_compare>'
+            '<!-- The question -->'
+            '<body>Question</body>'
+            '<explanation>Answer</explanation>'
+            '</submit_and_compare>'
+        )
+        self.assertEquals('<body>Question</body>', parsed_question.body)
+        self.assertEquals(
+            '<explanation>Answer</explanation>',
+            parsed_question.explanation,
+        )
+        self.assertEquals((), parsed_question.hints)
+
+    def test_parse_question_invalid(self):
+        """
+        Tests that questions missing required elements are rejected
+        """
+        with self.assertRaises(ValueError):
+            parse_question('<submit_and_compare><body/></submit_and_compare>')
+        with self.assertRaises(ValueError):
+            parse_question('<problem><body/><explanation/></problem>')
+
+    def test_get_body_without_explanation(self):
+        """
+        Tests that the body of a question is returned even when it has no
+        explanation
+        """
+        self.assertEquals(
+            '<body>Question</body>',
+            get_body('<submit_and_compare><body>Question</body>'
+                     '</submit_and_compare>'),
+        )
+        with self.assertRaises(ValueError):
+            get_body('<submit_and_compare><explanation/></submit_and_compare>')
+
+    def test_parse_question_several_demandhints(self):
+        """
+        Tests that the hints of every demandhint section are collected
+        """
+        parsed_question = parse_question(
+            '<submit_and_compare>'
+            '<body/>'
+            '<demandhint><hint>One</hint></demandhint>'
+            '<explanation/>'
+            '<demandhint><hint>Two</hint><hint>Three</hint></demandhint>'
+            '</submit_and_compare>'
+        )
+        self.assertEquals(
+            ('<hint>One</hint>', '<hint>Two</hint>', '<hint>Three</hint>'),
+            parsed_question.hints,
+        )
+
+    def test_studio_submit_stores_question_parts(self):
+        """
+        Tests that the parts of the question are serialized from the one
+        parse made when it is saved, and read back without parsing the XML
+        again
+        """
+        question_string = self.xblock.question_string.replace(
+            'Before you begin', 'Before we begin',
+        )
+        with mock.patch('lxml.etree.parse', wraps=etree.parse) as parse:
+            self.call_handler('studio_submit', self.studio_data(
+                data=question_string,
+            ))
+        self.assertEquals(0, parse.call_count)
+        self.assertIn('Before we begin', self.xblock.question_parts['body'])
+        self.assertEquals(2, len(self.xblock.question_parts['hints']))
+        clear_parsed_questions()
+        with mock.patch(
+            'submit_and_compare.submit_and_compare._parse_question',
+        ) as parser:
+            self.assertIn('Before we begin', self.student_view_html())
+            self.call_handler('send_hints', {})
+        self.assertEquals(0, parser.call_count)
+
+    def test_stale_question_parts_are_ignored(self):
+        """
+        Tests that question parts saved for other content are not used
+        """
+        self.xblock.question_parts = {
+            'version': 1,
+            'digest': 'stale',
+            'body': '<body>Stale</body>',
+            'explanation': '<explanation>Stale</explanation>',
+            'hints': [],
+        }
+        html = self.student_view_html()
+        self.assertNotIn('Stale', html)
+        self.assertIn('Before you begin', html)
+
+    def test_studio_submit_missing_body(self):
+        """
+        Tests that question XML without a body is rejected
+        """
+        result = self.call_handler('studio_submit', self.studio_data(
+            data='<submit_and_compare><explanation/></submit_and_compare>',
+        ))
+        self.assertEquals('error', result['result'])
+        self.assertEquals({}, self.xblock.question_parts)
+
+    def test_iter_learner_states(self):
+        """
+        Tests that learner state is read in keyset-paginated chunks
+        """
+        rows = [
+            {
+                'id': i,
+                'course_id': 'course-v1:foo+bar+baz',
+                'module_state_key': 'block-v1:foo+bar+baz+type@x+block@y',
+                'student_id': 100 + i,
+                'state': json.dumps({
+                    'student_answer': 'Answer {}'.format(i),
+                    'count_attempts': i,
+                    'score': 1.0,
+                }),
+            }
+            for i in range(1, 6)
+        ]
+        queryset = FakeStudentModuleQuerySet(rows)
+        records = list(iter_learner_states(queryset, chunk_size=2))
+        self.assertEquals([101, 102, 103, 104, 105],
+                          [record['user_id'] for record in records])
+        self.assertEquals('Answer 5', records[-1]['student_answer'])
+        self.assertEquals([0, 2, 4, 5], queryset.filtered_after)
+
+    def test_export_import_round_trip(self):
+        """
+        Tests that exported records are read back unchanged
+        """
+        records = [{
+            'course_id': u'course-v1:foo+bar+baz',
+            'block_id': u'block-v1:foo+bar+baz+type@x+block@y',
+            'user_id': 7,
+            'student_answer': u'Caf\xe9, "quoted"\nand multiline',
+            'count_attempts': 2,
+            'score': 1.0,
+        }]
+        for export_format in ('csv', 'jsonl'):
+            exported = b''.join(iter_export_lines(records, export_format))
+            imported = list(iter_import_records(
+                io.BytesIO(exported),
+                export_format,
+            ))
+            self.assertEquals(records, imported)
+
+    def test_import_learner_states(self):
+        # pylint: disable=protected-access
+        """
+        Tests that imported records are merged into existing rows and
+        inserted for learners without one
+        """
+        student_module = self.store_learner_rows()
+        records = [
+            {
+                'course_id': COURSE_ID,
+                'block_id': BLOCK_ID,
+                'user_id': user_id,
+                'student_answer': u'Imported {}'.format(user_id),
+                'count_attempts': 1,
+                'score': 0.5,
+            }
+            for user_id in (101, 105, 106)
+        ]
+        with mock.patch('submit_and_compare.bulk.MAX_UPDATE_BYTES', 80):
+            with mock.patch(
+                'submit_and_compare.bulk._write_states',
+                wraps=bulk._write_states,
+            ) as write_states:
+                imported = import_learner_states(records, chunk_size=2)
+        self.assertEquals(3, imported)
+        self.assertEquals(
+            [[1], [5]],
+            [
+                [change.id for change in call[0][1]]
+                for call in write_states.call_args_list
+            ],
+        )
+        states = {
+            row.student_id: json.loads(row.state)
+            for row in student_module.objects.all()
+        }
+        self.assertEquals(6, len(states))
+        for user_id in (101, 105, 106):
+            self.assertEquals(
+                {
+                    'student_answer': u'Imported {}'.format(user_id),
+                    'count_attempts': 1,
+                    'score': 0.5,
+                },
+                states[user_id],
+            )
+        self.assertEquals(2, states[102]['count_attempts'])
+        inserted = student_module.objects.get(student_id=106)
+        self.assertEquals(COURSE_ID, inserted.course_id)
+        self.assertEquals(BLOCK_ID, inserted.module_state_key)
+
+    def test_save_draft(self):
+        """
+        Tests that a draft is saved without being graded or published
+        """
+        result = self.call_handler('save_draft', {'answer': 'Half an answer'})
+        self.assertEquals('success', result['result'])
+        self.assertEquals('Half an answer', self.xblock.draft_answer)
+        self.assertEquals('', self.xblock.student_answer)
+        self.assertEquals(0, self.xblock.count_attempts)
+        self.assertEquals(0.0, self.xblock.score)
+        self.assertEquals([], self.published_events())
+
+    def test_draft_cleared_on_submit(self):
+        """
+        Tests that submitting an answer discards the draft
+        """
+        self.call_handler('save_draft', {'answer': 'Half an answer'})
+        self.call_handler('student_submit', {
+            'answer': 'A whole answer',
+            'action': 'submit',
+        })
+        self.assertEquals('', self.xblock.draft_answer)
+        self.assertEquals('A whole answer', self.xblock.student_answer)
+
+    def test_student_view_shows_draft(self):
+        """
+        Tests that the draft is only shown when autosave is enabled
+        """
+        self.xblock.student_answer = 'Submitted answer'
+        self.xblock.draft_answer = 'Draft answer'
+        self.assertIn('Submitted answer', self.student_view_html())
+        self.configure(draft_autosave=True)
+        html = self.student_view_html()
+        self.assertIn('Draft answer', html)
+        self.assertNotIn('Submitted answer', html)
+
+    def test_drafts_are_stored_per_user(self):
+        """
+        Tests that the student view knows whose drafts it stores
+        """
+        self.xblock.scope_ids.user_id = 42
+        fragment = self.xblock.student_view()
+        self.assertEquals(u'42', fragment.json_init_args['user_id'])
+
+    def test_lazy_explanation(self):
+        """
+        Tests that the explanation is left out of the view in lazy mode
+        and served by its own handler instead
+        """
+        explanation = parse_question(self.xblock.question_string).explanation
+        self.assertIn(explanation, self.student_view_html())
+        self.configure(lazy_explanation=True)
+        fragment = self.xblock.student_view()
+        self.assertNotIn(explanation, fragment.content)
+        self.assertTrue(fragment.json_init_args['lazy_explanation'])
+        response = self.xblock.get_explanation(Request.blank('/'))
+        self.assertEquals(200, response.status_int)
+        self.assertEquals(explanation, response.text)
+        self.assertTrue(response.etag)
+
+    def test_explanation_not_modified(self):
+        """
+        Tests that a current copy of the explanation is revalidated
+        """
+        etag = self.xblock.get_explanation(Request.blank('/')).etag
+        response = self.xblock.get_explanation(Request.blank(
+            '/',
+            headers={'If-None-Match': '"{}"'.format(etag)},
+        ))
+        self.assertEquals(304, response.status_int)
+        self.assertEquals(b'', response.body)
+        self.xblock.question_string = self.xblock.question_string.replace(
+            'no difference',
+            'a difference',
+        )
+        response = self.xblock.get_explanation(Request.blank(
+            '/',
+            headers={'If-None-Match': '"{}"'.format(etag)},
+        ))
+        self.assertEquals(200, response.status_int)
+
+    def test_asset_mode_url(self):
+        """
+        Tests that the public copies of the static resources are referenced
+        by URL in url mode, and inlined otherwise
+        """
+        manifest = {
+            'static/css/submit_and_compare.css':
+                'public/submit_and_compare.0123456789ab.css',
+            'static/js/submit_and_compare_view.js':
+                'public/submit_and_compare_view.0123456789ab.js',
+        }
+        self.xblock.runtime.local_resource_url.side_effect = (
+            lambda block, uri: '/resource/' + uri
+        )
+        with mock.patch(
+            'submit_and_compare.submit_and_compare._get_asset_manifest',
+            return_value=manifest,
+        ):
+            inline = self.xblock.student_view().resources
+            self.configure(asset_mode='url')
+            by_url = self.xblock.student_view().resources
+        self.assertEquals(['text', 'text'], [r.kind for r in inline])
+        self.assertEquals(
+            [
+                '/resource/public/submit_and_compare.0123456789ab.css',
+                '/resource/public/submit_and_compare_view.0123456789ab.js',
+            ],
+            [r.data for r in by_url],
+        )
+        self.assertEquals(['url', 'url'], [r.kind for r in by_url])
+
+    def test_asset_mode_url_without_manifest(self):
+        """
+        Tests that resources are inlined when no public copies were built
+        """
+        self.configure(asset_mode='url')
+        with mock.patch(
+            'submit_and_compare.submit_and_compare._get_asset_manifest',
+            return_value={},
+        ):
+            resources = self.xblock.student_view().resources
+        self.assertEquals(['text', 'text'], [r.kind for r in resources])
+
+    def test_compact_state(self):
+        # pylint: disable=unsubscriptable-object
+        """
+        Tests that learner state is stored in one record in compact mode
+        """
+        self.configure(compact_state=True)
+        self.call_handler('student_submit', {
+            'answer': 'My answer',
+            'action': 'submit',
+        })
+        self.assertEquals(
+            {'v': 1, 'a': 'My answer', 'n': 1, 's': 1.0},
+            self.xblock.learner_state,
+        )
+        for name in ('student_answer', 'count_attempts', 'score'):
+            self.assertFalse(self.xblock.fields[name].is_set_on(self.xblock))
+        self.assertIn('My answer', self.student_view_html())
+        self.assertEquals(
+            [
+                ('grade', {'value': 1.0, 'max_value': 1.0}),
+                ('problem_check', {'grade': 1.0, 'max_grade': 1.0}),
+            ],
+            self.published_events(),
+        )
+
+    def test_compact_state_compresses_long_answers(self):
+        """
+        Tests that answers above the threshold are compressed
+        """
+        answer = u'All work and no play makes Jack a dull boy. ' * 100
+        learner_state = LearnerState(
+            answer=answer,
+            attempts=3,
+            score=1.0,
+            graded=True,
+        )
+        record = pack_learner_state(learner_state, threshold=1024)
+        self.assertTrue(record['z'])
+        self.assertLess(len(record['a']), len(answer) / 10)
+        self.assertEquals(learner_state, unpack_learner_state(record))
+        record = pack_learner_state(learner_state, threshold=len(answer))
+        self.assertNotIn('z', record)
+        self.assertEquals(answer, record['a'])
+
+    def test_compact_state_missing_answer(self):
+        """
+        Tests that a missing answer is stored as an empty one
+        """
+        learner_state = EMPTY_LEARNER_STATE._replace(answer=None, attempts=1)
+        self.assertEquals(
+            {'v': 1, 'a': u'', 'n': 1},
+            pack_learner_state(learner_state),
+        )
+
+    def test_compact_state_migration(self):
+        # pylint: disable=protected-access
+        """
+        Tests that legacy state is read as is, and moved to the record
+        with the next write
+        """
+        self.xblock.student_answer = 'Old answer'
+        self.xblock.count_attempts = 2
+        self.xblock.score = 1.0
+        self.xblock.save()
+        self.configure(compact_state=True)
+        html = self.student_view_html()
+        self.assertIn('Old answer', html)
+        self.assertEquals([], list(self.xblock._get_fields_to_save()))
+        self.call_handler('student_submit', {
+            'answer': 'Old answer',
+            'action': 'submit',
+        })
+        self.assertEquals(
+            {'v': 1, 'a': 'Old answer', 'n': 3, 's': 1.0},
+            self.xblock.learner_state,
+        )
+        self.assertEquals('', self.xblock.student_answer)
+        self.assertEquals(0, self.xblock.count_attempts)
+        self.assertEquals(
+            ['problem_check'],
+            [event[0] for event in self.published_events()],
+        )
+
+    def test_compact_state_disabled(self):
+        """
+        Tests that a record is moved back to the legacy fields when
+        compact_state is turned off
+        """
+        self.xblock.learner_state = {'v': 1, 'a': 'My answer', 'n': 1}
+        self.call_handler('student_submit', {
+            'answer': 'My answer',
+            'action': 'submit',
+        })
+        self.assertEquals({}, self.xblock.learner_state)
+        self.assertEquals('My answer', self.xblock.student_answer)
+        self.assertEquals(2, self.xblock.count_attempts)
+        self.assertEquals(1.0, self.xblock.score)
+
+    def test_export_compact_state(self):
+        """
+        Tests that compact records are exported like the legacy fields
+        """
+        state = json.dumps({
+            'learner_state': {'v': 1, 'a': 'My answer', 'n': 2, 's': 1.0},
+        })
+        self.assertEquals(
+            {
+                'student_answer': 'My answer',
+                'count_attempts': 2,
+                'score': 1.0,
+            },
+            state_to_record(state),
+        )
+
+    def test_similarity_scores(self):
+        """
+        Tests that answers closer to the explanation score higher
+        """
+        explanation = parse_question(self.xblock.question_string).explanation
+        answers = [
+            'There is no difference between the two scenarios; we would '
+            'gather the time and the temperature.',
+            'The two scenarios differ in temperature.',
+            'I like turtles.',
+            '',
+        ]
+        scores = score_answers(explanation, answers)
+        self.assertEquals(1.0, scores[0])
+        self.assertTrue(0.0 < scores[1] < 1.0)
+        self.assertEquals([0.0, 0.0], scores[2:])
+        self.assertEquals(
+            scores,
+            [score_answer(explanation, answer) for answer in answers],
+        )
+        self.assertIs(
+            get_expert_model(explanation),
+            get_expert_model(explanation),
+        )
+
+    def test_scoring_mode_similarity(self):
+        """
+        Tests that submissions get partial credit in similarity mode
+        """
+        self.configure(scoring_mode='similarity')
+        self.call_handler('student_submit', {
+            'answer': 'The two scenarios differ in temperature.',
+            'action': 'submit',
+        })
+        self.assertTrue(0.0 < self.xblock.score < 1.0)
+        self.assertEquals(
+            ('grade', {'value': self.xblock.score, 'max_value': 1.0}),
+            self.published_events()[0],
+        )
+
+    def test_scoring_invalid_settings(self):
+        # pylint: disable=protected-access
+        """
+        Tests that an unknown scoring_mode or a non-positive
+        similarity_full_credit fall back to their defaults
+        """
+        answers = ['The two scenarios differ in temperature.', '']
+        self.configure(scoring_mode='similarity')
+        expected = self.xblock._score_answers(answers)
+        for full_credit in (0, -1):
+            self.configure(
+                scoring_mode='similarity',
+                similarity_full_credit=full_credit,
+            )
+            self.assertEquals(expected, self.xblock._score_answers(answers))
+        self.configure(scoring_mode='smilarity')
+        self.assertEquals([1.0, 0.0], self.xblock._score_answers(answers))
+
+    def test_scoring_mode_similarity_without_numpy(self):
+        """
+        Tests that answers are scored on being non-empty without NumPy
+        """
+        self.configure(scoring_mode='similarity')
+        with mock.patch(
+            'submit_and_compare.scoring._numpy',
+            side_effect=ImportError,
+        ):
+            self.call_handler('student_submit', {
+                'answer': 'I like turtles.',
+                'action': 'submit',
+            })
+        self.assertEquals(1.0, self.xblock.score)
+
+    def test_heavy_modules_are_imported_lazily(self):
+        """
+        Tests that no module of the package imports, when it is itself
+        imported, the modules only needed by some views and handlers
+        """
+        lazy_modules = (
+            'django.core.cache',
+            'django.template',
+            'lxml',
+            'numpy',
+            'pkg_resources',
+        )
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        for filename in sorted(os.listdir(package_dir)):
+            if not filename.endswith('.py') or filename == 'tests.py':
+                continue
+            with open(os.path.join(package_dir, filename)) as source:
+                tree = ast.parse(source.read(), filename)
+            for name in top_level_imports(tree):
+                for lazy_module in lazy_modules:
+                    self.assertFalse(
+                        name == lazy_module or
+                        name.startswith(lazy_module + '.'),
+                        '{} imports {}'.format(filename, name),
+                    )
+
+    def learner_rows(self):
+        # pylint: disable=no-self-use
+        """
+        Helper method that returns StudentModule rows of five learners,
+        the first of whom has not submitted yet
+        """
+        rows = [{'id': 1, 'student_id': 101, 'state': '{}'}]
+        for i in range(2, 5):
+            rows.append({
+                'id': i,
+                'student_id': 100 + i,
+                'state': json.dumps({
+                    'student_answer': 'x' * (i - 2),
+                    'count_attempts': i,
+                    'score': 0.5,
+                }),
+            })
+        rows.append({
+            'id': 5,
+            'student_id': 105,
+            'state': json.dumps({
+                'learner_state': {'v': 1, 'a': 'y', 'n': 1, 's': 1.0},
+            }),
+        })
+        return rows
+
+    def store_learner_rows(self):
+        """
+        Helper method that stores the rows of learner_rows in a stand-in
+        StudentModule table, and returns its model
+        """
+        with connection.schema_editor() as editor:
+            editor.create_model(FakeStudentModule)
+        self.addCleanup(self.drop_student_module_table)
+        for row in self.learner_rows():
+            FakeStudentModule.objects.create(**row)
+        patcher = mock.patch(
+            'submit_and_compare.bulk._get_student_module_model',
+            return_value=FakeStudentModule,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return FakeStudentModule
+
+    @staticmethod
+    def drop_student_module_table():
+        """
+        Helper method that drops the stand-in StudentModule table
+        """
+        with connection.schema_editor() as editor:
+            editor.delete_model(FakeStudentModule)
+
+    def test_update_learner_states(self):
+        """
+        Tests that learner states are updated and written back in chunks
+        """
+        student_module = self.store_learner_rows()
+        with mock.patch('submit_and_compare.bulk.MAX_UPDATE_BYTES', 80):
+            chunks = list(update_learner_states(
+                student_module.objects.all(),
+                reset_attempts,
+                1024,
+                chunk_size=2,
+            ))
+        self.assertEquals(
+            [[102], [103, 104], [105]],
+            [[user_id for user_id, _ in chunk] for chunk in chunks],
+        )
+        self.assertEquals(
+            [0, 0, 0, 0],
+            [state.attempts for chunk in chunks for _, state in chunk],
+        )
+        states = [
+            state_to_record(row.state)
+            for row in student_module.objects.order_by('id')
+        ]
+        self.assertEquals(
+            [0] * 5,
+            [state['count_attempts'] for state in states],
+        )
+        self.assertEquals(
+            ['', '', 'x', 'xx', 'y'],
+            [state['student_answer'] for state in states],
+        )
+
+    def test_update_learner_states_compression_threshold(self):
+        """
+        Tests that compact records are packed with the given threshold
+        """
+        student_module = self.store_learner_rows()
+        student_module.objects.filter(id=5).update(state=json.dumps({
+            'learner_state': {'v': 1, 'a': 'y' * 100, 'n': 1, 's': 1.0},
+        }))
+        list(update_learner_states(
+            student_module.objects.filter(id=5),
+            reset_attempts,
+            10,
+        ))
+        record = json.loads(
+            student_module.objects.get(id=5).state
+        )['learner_state']
+        self.assertTrue(record['z'])
+        self.assertEquals(
+            LearnerState(u'y' * 100, 0, 1.0, True),
+            unpack_learner_state(record),
+        )
+
+    def test_update_learner_states_after_submission(self):
+        # pylint: disable=protected-access
+        """
+        Tests that a learner who submits while their state is being updated
+        is updated again rather than overwritten
+        """
+        student_module = self.store_learner_rows()
+        rows = list(student_module.objects.filter(id__in=[2, 3]).values(
+            'id',
+            'student_id',
+            'state',
+        ))
+        changes = bulk._update_chunk(rows, reset_attempts, 1024)
+        student_module.objects.filter(id=3).update(state=json.dumps({
+            'student_answer': 'Submitted meanwhile',
+            'count_attempts': 7,
+            'score': 1.0,
+        }))
+        self.assertEquals(
+            [102, 103],
+            [user_id for user_id, _ in bulk._write_chunk(
+                changes,
+                reset_attempts,
+                1024,
+            )],
+        )
+        self.assertEquals(
+            {
+                'student_answer': 'Submitted meanwhile',
+                'count_attempts': 0,
+                'score': 1.0,
+            },
+            state_to_record(student_module.objects.get(id=3).state),
+        )
+
+    def test_rescorer(self):
+        # pylint: disable=protected-access
+        """
+        Tests that only learners who were graded are rescored
+        """
+        rescore = rescorer(self.xblock._score_answers)
+        learner_states = [
+            LearnerState(u'', 0, 0.0, False),
+            LearnerState(u'', 1, 1.0, True),
+            LearnerState(u'My answer', 1, 0.5, True),
+        ]
+        self.assertEquals(
+            [
+                LearnerState(u'', 0, 0.0, False),
+                LearnerState(u'', 1, 0.0, True),
+                LearnerState(u'My answer', 1, 1.0, True),
+            ],
+            rescore(learner_states),
+        )
+
+    def test_update_block_learners(self):
+        """
+        Tests that rescoring every learner of a block publishes their
+        grades one chunk at a time
+        """
+        self.store_learner_rows()
+        with mock.patch(
+            'submit_and_compare.bulk.get_learner_states',
+            return_value=FakeStudentModule.objects.all(),
+        ), mock.patch(
+            'submit_and_compare.bulk._load_block',
+            return_value=self.xblock,
+        ), mock.patch('submit_and_compare.bulk.publish_grades') as publish:
+            updated = update_block_learners(
+                'block-v1:Org+Course+Run+type@submit-and-compare+block@1',
+                'rescore',
+                chunk_size=3,
+            )
+        self.assertEquals(3, updated)
+        self.assertEquals(
+            [[(102, 0.0), (103, 1.0)], [(104, 1.0)]],
+            [
+                [
+                    (user_id, learner_state.score)
+                    for user_id, learner_state in call[0][1]
+                ]
+                for call in publish.call_args_list
+            ],
+        )
+
+    def test_bulk_update_learners(self):
+        """
+        Tests that updating every learner is queued as a task
+        """
+        BULK_UPDATE_TASK.reset_mock()
+        self.xblock.runtime.user_is_staff = True
+        result = self.call_handler('bulk_update_learners', {
+            'action': 'rescore',
+        })
+        self.assertEquals('error', result['result'])
+        self.configure(bulk_update_task='submit_and_compare.tests.NO_TASK')
+        result = self.call_handler('bulk_update_learners', {
+            'action': 'rescore',
+        })
+        self.assertEquals('error', result['result'])
+        self.configure(
+            bulk_update_task='submit_and_compare.tests.BULK_UPDATE_TASK',
+            bulk_chunk_size=10,
+        )
+        result = self.call_handler('bulk_update_learners', {
+            'action': 'rescore',
+        })
+        self.assertEquals({'result': 'success', 'queued': True}, result)
+        BULK_UPDATE_TASK.apply_async.assert_called_once_with(
+            args=[unicode(self.xblock.scope_ids.usage_id), 'rescore'],
+            kwargs={'chunk_size': 10, 'compression_threshold': 1024},
+        )
+
+    def test_bulk_update_learners_staff_only(self):
+        """
+        Tests that learners cannot update every learner
+        """
+        self.xblock.runtime.user_is_staff = False
+        result = self.call_handler('bulk_update_learners', {
+            'action': 'reset',
+        })
+        self.assertEquals('error', result['result'])
+
+    def export_olx(self):
+        """
+        Helper method that returns the OLX node of the xblock
+        """
+        self.xblock.scope_ids.block_type = 'submit-and-compare'
+        node = etree.Element('submit-and-compare')
+        self.xblock.add_xml_to_node(node)
+        return node
+
+    def import_olx(self, node):
+        # pylint: disable=no-self-use
+        """
+        Helper method that builds an xblock from an OLX node
+        """
+        runtime = mock.Mock()
+        runtime.construct_xblock_from_class.side_effect = (
+            lambda cls, keys: cls(runtime, DictFieldData({}), keys)
+        )
+        return SubmitAndCompareXBlock.parse_xml(
+            node,
+            runtime,
+            mock.Mock(),
+            mock.Mock(),
+        )
+
+    def test_olx_export(self):
+        """
+        Tests that the question is exported as child elements
+        """
+        self.xblock.display_name = 'Hypothesis'
+        node = self.export_olx()
+        self.assertEquals(
+            ['body', 'explanation', 'demandhint'],
+            [child.tag for child in node],
+        )
+        self.assertEquals('1', node.get('schema_version'))
+        self.assertEquals('Hypothesis', node.get('display_name'))
+        self.assertIsNone(node.get('question_string'))
+        self.assertIsNone(node.get('question_parts'))
+
+    def test_olx_round_trip(self):
+        """
+        Tests that exported OLX imports as the same question
+        """
+        self.xblock.display_name = 'Hypothesis'
+        self.xblock.weight = 3
+        block = self.import_olx(
+            etree.fromstring(etree.tostring(self.export_olx()))
+        )
+        self.assertEquals('Hypothesis', block.display_name)
+        self.assertEquals(3, block.weight)
+        self.assertEquals(
+            parse_question(self.xblock.question_string),
+            parse_question(block.question_string),
+        )
+        self.assertEquals(
+            content_key(block.question_string),
+            block.question_parts['digest'],
+        )
+        self.assertEquals(
+            parse_question(block.question_string).explanation,
+            block.question_parts['explanation'],
+        )
+
+    def test_olx_export_encoding_declaration(self):
+        """
+        Tests that a question lxml cannot parse from text is exported as
+        an attribute
+        """
+        question_string = (
+            u"<?xml version='1.0' encoding='utf-8'?>\n" +
+            self.xblock.question_string
+        )
+        self.xblock.question_string = question_string
+        node = self.export_olx()
+        self.assertEquals([], list(node))
+        self.assertEquals(question_string, node.get('question_string'))
+
+    def test_olx_import_missing_explanation(self):
+        """
+        Tests that OLX whose question has no explanation still imports,
+        without question parts
+        """
+        node = etree.Element('submit-and-compare')
+        etree.SubElement(node, 'body').text = 'Question'
+        block = self.import_olx(node)
+        self.assertIn('<body>Question</body>', block.question_string)
+        self.assertEquals({}, block.question_parts)
+
+    def test_legacy_olx_import(self):
+        """
+        Tests that OLX with a question_string attribute still imports
+        """
+        question_string = self.xblock.question_string.replace(
+            'no difference',
+            'a difference',
+        )
+        node = etree.Element('submit-and-compare')
+        node.set('display_name', 'Hypothesis')
+        node.set('question_string', question_string)
+        block = self.import_olx(node)
+        self.assertEquals('Hypothesis', block.display_name)
+        self.assertEquals(question_string, block.question_string)
+        self.assertIn('a difference', block.question_parts['explanation'])
+
+    def test_analytics(self):
+        """
+        Tests that submissions, resets and hint clicks are tallied
+        """
+        for action, answer in (
+                ('submit', 'x' * 5),
+                ('submit', 'x' * 100),
+                ('reset', ''),
+        ):
+            self.call_handler('student_submit', {
+                'answer': answer,
+                'action': action,
+            })
+        self.call_handler('publish_events', {
+            'events': [{'event_type': 'hint_button'}] * 3,
+        })
+        other_learner = self.make_an_xblock()
+        other_learner.scope_ids.usage_id = self.xblock.scope_ids.usage_id
+        self.xblock = other_learner
+        self.call_handler('student_submit', {
+            'answer': 'x',
+            'action': 'submit',
+        })
+        self.xblock.runtime.user_is_staff = True
+        analytics = self.call_handler('get_analytics', {})
+        self.assertEquals(3, analytics['submissions'])
+        self.assertEquals(1, analytics['resets'])
+        self.assertEquals(0.25, analytics['reset_rate'])
+        self.assertEquals(3, analytics['hint_clicks'])
+        self.assertEquals({'1': 1, '2': 1}, analytics['attempts'])
+        self.assertEquals(
+            {'1': 1, '4': 1, '64': 1},
+            analytics['answer_lengths'],
+        )
+
+    def test_analytics_staff_only(self):
+        """
+        Tests that learners cannot see the analytics
+        """
+        self.xblock.runtime.user_is_staff = False
+        result = self.call_handler('get_analytics', {})
+        self.assertEquals('error', result['result'])
+
+
+def top_level_imports(node):
+    """
+    Yields the names of the modules imported by the statements of a
+    syntax tree that run on import, i.e. outside of functions; names
+    imported from a module count as possible submodules
+    """
+    for child in ast.iter_child_nodes(node):
+        if isinstance(child, (ast.FunctionDef, ast.Lambda)):
+            continue
+        if isinstance(child, ast.Import):
+            for alias in child.names:
+                yield alias.name
+        elif isinstance(child, ast.ImportFrom) and not child.level:
+            yield child.module
+            for alias in child.names:
+                yield '{}.{}'.format(child.module, alias.name)
+        else:
+            for name in top_level_imports(child):
+                yield name
+
+
+# The task queued by bulk_update_learners in the tests
+BULK_UPDATE_TASK = mock.Mock()
+
+
+COURSE_ID = u'course-v1:foo+bar+baz'
+BLOCK_ID = u'block-v1:foo+bar+baz+type@submit-and-compare+block@1'
+
+
+class FakeStudentModule(models.Model):
+    """
+    A stand-in for the LMS StudentModule model, with the fields used by
+    the bulk updates
+    """
+    module_type = models.CharField(max_length=64, default='submit-and-compare')
+    course_id = models.CharField(max_length=255, default=COURSE_ID)
+    module_state_key = models.CharField(max_length=255, default=BLOCK_ID)
+    student_id = models.IntegerField()
+    state = models.TextField(null=True)
+
+    objects = models.Manager()
+
+    class Meta(object):
+        # pylint: disable=missing-docstring, too-few-public-methods
+        app_label = 'submit_and_compare'
+
+
+class FakeStudentModuleQuerySet(object):
+    """
+    Just enough of a StudentModule queryset for iter_learner_states
+    """
+
+    def __init__(self, rows, filtered_after=None):
+        self.rows = rows
+        if filtered_after is None:
+            filtered_after = []
+        self.filtered_after = filtered_after
+
+    def filter(self, id__gt):
+        # pylint: disable=invalid-name
+        """
+        Keeps the rows after a primary key
+        """
+        self.filtered_after.append(id__gt)
+        return FakeStudentModuleQuerySet(
+            [row for row in self.rows if row['id'] > id__gt],
+            self.filtered_after,
+        )
+
+    def order_by(self, field):
+        """
+        Sorts the rows
+        """
+        return FakeStudentModuleQuerySet(
+            sorted(self.rows, key=lambda row: row[field]),
+            self.filtered_after,
+        )
+
+    def values(self, *fields):
+        """
+        Returns the rows as dicts
+        """
+        return [{field: row[field] for field in fields} for row in self.rows]